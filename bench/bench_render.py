@@ -0,0 +1,156 @@
+"""Frame time, ingest time and memory benchmarks for the UI pipeline.
+
+Runs State, PageManager, ChannelChatPage and the Renderer against the in-memory
+backend, so no terminal or Discord connection is needed.
+
+	python bench/bench_render.py
+	python bench/bench_render.py --sizes 100 1000 --widths 80 --densities heavy
+"""
+import argparse
+import datetime
+import os
+import random
+import string
+import sys
+import time
+import tracemalloc
+
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import config
+import page
+
+from state import State
+from render import Renderer, MemoryBackend
+
+# Fraction of words that get wrapped in markup
+DENSITIES = {
+	'none': 0.0,
+	'light': 0.05,
+	'heavy': 0.4,
+}
+
+MARKUP = ('**{}**', '*{}*', '`{}`', '_{}_', '<g>{}<g>', '<r>{}<r>', '<y>{}<y>')
+
+def make_content(rng, density):
+	words = []
+	for _ in range(rng.randint(2, 40)):
+		word = ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(1, 10)))
+		if rng.random() < density:
+			word = rng.choice(MARKUP).format(word)
+		words.append(word)
+	return ' '.join(words)
+
+def make_messages(n, density, seed = 0):
+	rng = random.Random(seed)
+	channel = SimpleNamespace(id = 1)
+	start = datetime.datetime(2024, 1, 1, tzinfo = datetime.timezone.utc)
+	authors = [SimpleNamespace(id = i, display_name = f'user{i}') for i in range(1, 20)]
+	return [
+		SimpleNamespace(
+			id = i,
+			channel = channel,
+			author = rng.choice(authors),
+			content = make_content(rng, density),
+			created_at = start + datetime.timedelta(seconds = i),
+		)
+		for i in range(n)
+	]
+
+def make_state(width, height):
+	# Keep the benchmark off the disk
+	config.MESSAGE_STORE_PATH = None
+	state = State()
+	renderer = Renderer(MemoryBackend())
+	renderer.resize(height, width)
+
+	bot = SimpleNamespace(user = SimpleNamespace(id = 0), state = state)
+	channel_page = page.ChannelChatPage(SimpleNamespace(id = 1, name = 'bench'), bot)
+	# Skip fetching history
+	channel_page.opened = channel_page.history_loaded = True
+	state.pageman.add_page(channel_page)
+	state.pageman.set_focus(channel_page)
+
+	# The first frame gives the page its dimensions
+	renderer.draw(state)
+	return state, renderer, channel_page
+
+def percentile(samples, p):
+	samples = sorted(samples)
+	return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+def ingest(state, messages):
+	for message in messages:
+		state.pageman.process_message(message)
+
+def bench_ingest(messages, width, height):
+	state, renderer, channel_page = make_state(width, height)
+	start = time.perf_counter()
+	ingest(state, messages)
+	elapsed = time.perf_counter() - start
+	return elapsed / len(messages), state, renderer, channel_page
+
+def bench_frames(state, renderer, channel_page, frames, scroll):
+	samples = []
+	for _ in range(frames):
+		if scroll:
+			channel_page.on_scroll_up()
+		start = time.perf_counter()
+		renderer.draw(state)
+		samples.append(time.perf_counter() - start)
+	return samples
+
+def scroll_to_top(channel_page):
+	"""Page Up through the whole scrollback. Returns the most lines the page held in memory at once."""
+	peak = len(channel_page.lines)
+	while channel_page.lines.base or channel_page.current_scroll_head > 0:
+		channel_page.on_page_up()
+		peak = max(peak, len(channel_page.lines))
+	return peak
+
+def bench_memory(messages, width, height):
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	state, renderer, channel_page = make_state(width, height)
+	ingest(state, messages)
+	used = tracemalloc.get_traced_memory()[0] - before
+	tracemalloc.stop()
+	return used
+
+def main():
+	parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+	parser.add_argument('--sizes', type = int, nargs = '+', default = [100, 1000, 10000, 100000])
+	parser.add_argument('--widths', type = int, nargs = '+', default = [80, 200])
+	parser.add_argument('--densities', nargs = '+', default = list(DENSITIES), choices = list(DENSITIES))
+	parser.add_argument('--height', type = int, default = 60)
+	parser.add_argument('--frames', type = int, default = 200)
+	parser.add_argument('--no-memory', action = 'store_true', help = 'skip the (slow) tracemalloc pass')
+	args = parser.parse_args()
+
+	print(f'scrollback cap {config.SCROLLBACK_LINES} lines, height {args.height}, {args.frames} frames')
+	print(f'{"messages":>9} {"width":>5} {"markup":>6} | {"ingest us/msg":>13} | {"idle p50/p99 ms":>15} | {"scroll p50/p99 ms":>17} | {"peak lines":>10} | {"memory KiB":>10}')
+	for density in args.densities:
+		for size in args.sizes:
+			messages = make_messages(size, DENSITIES[density])
+			for width in args.widths:
+				per_message, state, renderer, channel_page = bench_ingest(messages, width, args.height)
+				idle = bench_frames(state, renderer, channel_page, args.frames, scroll = False)
+				scroll = bench_frames(state, renderer, channel_page, args.frames, scroll = True)
+				peak = scroll_to_top(channel_page)
+				# Scrolling up may hold one chunk over the cap, never more
+				assert peak <= config.SCROLLBACK_LINES + config.SCROLLBACK_CHUNK, f'{peak} lines in memory while scrolling up'
+				memory = '-' if args.no_memory else f'{bench_memory(messages, width, args.height) / 1024:.0f}'
+
+				print(
+					f'{size:>9} {width:>5} {density:>6} | '
+					f'{per_message * 1e6:>13.1f} | '
+					f'{percentile(idle, 0.5) * 1e3:>7.3f}/{percentile(idle, 0.99) * 1e3:<7.3f} | '
+					f'{percentile(scroll, 0.5) * 1e3:>8.3f}/{percentile(scroll, 0.99) * 1e3:<8.3f} | '
+					f'{peak:>10} | '
+					f'{memory:>10}'
+				)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,73 @@
+class ChannelActivity:
+	"""What happened in a channel since it was last looked at"""
+	__slots__ = ('unread', 'last_message_id', 'mentioned')
+
+	def __init__(self):
+		self.unread = 0
+		self.last_message_id = 0
+		self.mentioned = False
+
+class ActivityTable:
+	"""Unread counts and mentions for every channel, whether or not it has a page.
+
+	Updated in O(1) per message. The totals for the modal are kept up to date as
+	it goes, and `changed` collects the channels whose entry changed so the
+	channel list only has to redraw those.
+	"""
+	def __init__(self):
+		self.own_id = None
+		self._channels = {}
+		self.changed = set()
+
+		self.unread_channels = 0
+		self.mentioned_channels = 0
+
+	def get(self, channel_id):
+		return self._channels.get(channel_id)
+
+	def record(self, message):
+		if message.author.id == self.own_id:
+			return
+
+		channel_id = message.channel.id
+		entry = self._channels.get(channel_id)
+		if entry is None:
+			entry = self._channels[channel_id] = ChannelActivity()
+
+		if not entry.unread:
+			self.unread_channels += 1
+		entry.unread += 1
+		entry.last_message_id = message.id
+
+		if not entry.mentioned and self.mentions_me(message):
+			entry.mentioned = True
+			self.mentioned_channels += 1
+
+		self.changed.add(channel_id)
+
+	def mentions_me(self, message):
+		if getattr(message, 'mention_everyone', False):
+			return True
+		return any(user.id == self.own_id for user in getattr(message, 'mentions', ()))
+
+	def mark_read(self, channel_id):
+		entry = self._channels.get(channel_id)
+		if entry is None or not entry.unread:
+			return
+
+		self.unread_channels -= 1
+		if entry.mentioned:
+			self.mentioned_channels -= 1
+		entry.unread = 0
+		entry.mentioned = False
+		self.changed.add(channel_id)
+
+	def summary(self):
+		"""Short markup for the modal, empty when there is nothing unread"""
+		if not self.unread_channels:
+			return ''
+
+		res = f'<y>{self.unread_channels} unread<y>'
+		if self.mentioned_channels:
+			res += f' <r>{self.mentioned_channels} @<r>'
+		return res
@@ -18,29 +18,67 @@ class Vuut(discord.Client):
 		self.state = state
 
 	async def on_ready(self):
-		landing = page.OptionsPage(window_dimensions = self.state.window_dimensions)
+		landing = page.ChannelListPage(self.state.activity, window_dimensions = self.state.window_dimensions)
+		self.state.activity.own_id = self.user.id
+		if self.state.recorder is not None:
+			self.state.recorder.ready(self.user.id, self.guilds)
+
+		# Channel pages are only built once they are selected or prefetched
+		self.state.pageman.page_factory = self.make_channel_page
 
 		for guild in self.guilds:
 			landing.add_line(f"**{guild.name}**")
 			for channel in guild.channels:
-				channel_page = page.ChannelChatPage(channel, self)
-
-				idx = landing.add_option(channel_page)
-				self.state.pageman.add_page(channel_page)
+				# Categories have no messages of their own
+				if not hasattr(channel, 'history'):
+					continue
 
-				landing.add_line(8*" " + f'{idx}. #{channel.name}')
+				landing.add_channel(channel)
+				self.state.pageman.add_channel(channel)
 
 		# self.state.pageman.set_focus(self.state.pageman.channel_pages_mapping[TARGET_CHANNEL_ID])
 		self.state.pageman.set_focus(landing)
+		self.state.prefetch_history()
 
 		if isinstance(self.state.pageman.focus, page.ChannelChatPage) and self.state.pageman.focus.opened == False:
 			self.state.pageman.focus.on_first_open()
 
+	def make_channel_page(self, channel):
+		return page.ChannelChatPage(channel, self, window_dimensions = self.state.window_dimensions)
+
 	async def on_message(self, message):
-		channel_id = message.channel.id
-		await self.state.pageman.process_message(message, show_time = True)
+		if self.state.recorder is not None:
+			self.state.recorder.message(message)
+
+		# Only queued here, the UI loop applies it on the next frame
+		await self.state.ingest_queue.put(('message', message))
+
+	# The raw events fire whether or not discord.py has the message cached,
+	# so on_message_edit and on_message_delete would only be duplicates of them
+	async def on_raw_message_edit(self, payload):
+		content = payload.data.get('content')
+		# Edits that only touch embeds and the like don't carry the content
+		if content is None:
+			return
+
+		if self.state.recorder is not None:
+			self.state.recorder.edit(payload.channel_id, payload.message_id, content)
+		await self.state.ingest_queue.put(('edit', payload.channel_id, payload.message_id, content))
+
+	async def on_raw_message_delete(self, payload):
+		if self.state.recorder is not None:
+			self.state.recorder.delete(payload.channel_id, [payload.message_id])
+		await self.state.ingest_queue.put(('delete', payload.channel_id, [payload.message_id]))
+
+	async def on_raw_bulk_message_delete(self, payload):
+		if self.state.recorder is not None:
+			self.state.recorder.delete(payload.channel_id, payload.message_ids)
+		await self.state.ingest_queue.put(('delete', payload.channel_id, list(payload.message_ids)))
 
 	async def on_presence_update(self, before, after):
+		if self.state.recorder is not None:
+			self.state.recorder.presence(before, after)
+
 		if not isinstance(self.state.pageman.focus, page.ChannelChatPage):
 			return
 
@@ -72,10 +110,4 @@ class Vuut(discord.Client):
 				clr = ''
 
 		self.state.pageman.focus.add_line(Text(f'{clr}{msg}{clr}'))
-			
-		if os.name == 'posix': # Use linux notification api
-			try:
-				os.system(f'notify-send "Status Update" "{after.display_name}: {before.status} -> {after.status}" -u critical')
-			except Exception as e:
-				logging.error(e)
-				pass
+		self.state.notifier.notify(after.id, "Status Update", f"{after.display_name}: {before.status} -> {after.status}")
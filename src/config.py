@@ -11,6 +11,60 @@ OUTPUT_BORDER_ENABLED = 1
 
 PREFIX_LEN = 32
 
+# Messages loaded when a channel page is first opened
+HISTORY_LIMIT = 100
+# SQLite file that channel history is kept in between sessions. None to disable
+MESSAGE_STORE_PATH = 'messages.db'
+# Channel histories fetched in the background at the same time
+HISTORY_PREFETCH_CONCURRENCY = 3
+# Minimum seconds between the start of two history fetches, to stay clear of rate limits
+HISTORY_PREFETCH_INTERVAL = 0.25
+# Number of recently opened channels whose history is loaded on startup
+HISTORY_PREFETCH_CHANNELS = 12
+# Channel IDs whose history is always loaded on startup
+PINNED_CHANNELS = []
+
+# Where desktop notifications go: 'notify-send', or None for nowhere
+NOTIFY_BACKEND = 'notify-send'
+# Seconds before the same user can trigger another notification
+NOTIFY_USER_INTERVAL = 60
+# Notifications that come in within this many seconds of each other are sent together
+NOTIFY_COALESCE_WINDOW = 1
+# Bursts bigger than this are sent as one summary notification
+NOTIFY_BURST = 3
+
+# Upper bound on frames drawn per second. None for no limit
+MAX_FPS = 30
+
+# Messages waiting between the gateway and the pages before new ones have to wait
+INGEST_QUEUE_SIZE = 10000
+# Seconds a new message waits for room in a full queue before it is dropped
+INGEST_PUT_TIMEOUT = 5
+# Messages applied to the pages per frame
+INGEST_BATCH = 500
+
+# Logical lines each channel page keeps in memory. Older lines are spilled to disk.
+SCROLLBACK_LINES = 5000
+# Lines are evicted and paged back in this many at a time
+SCROLLBACK_CHUNK = 500
+# Where spill files are created. None uses the system temporary directory
+SCROLLBACK_SPILL_DIR = None
+# Lines rewrapped per frame after a resize
+REFLOW_CHUNK = 300
+
+# Most results :search lists
+SEARCH_RESULTS_LIMIT = 100
+
+# Characters :export holds before writing them out
+EXPORT_BUFFER_SIZE = 1 << 16
+
+# Record the gateway events of a live session to this file. None to not record
+RECORD_PATH = None
+# Replay a recording instead of connecting. None to connect as usual
+REPLAY_PATH = None
+# How many times faster than real time the recording is replayed. 0 for as fast as possible
+REPLAY_SPEED = 1
+
 DEBUG = False
 START_BOT = True
 DISABLE_MESSAGE_SEND = True
@@ -0,0 +1,99 @@
+import asyncio
+import datetime
+import json
+import logging
+
+import config
+
+from message import MessageRecord, DELETED
+
+# Export tasks that are running, so they aren't garbage collected halfway
+_tasks = set()
+
+async def api_messages(channel, own_id):
+	"""Every message of a channel, oldest first, fetched from the API a page at a time"""
+	async for message in channel.history(limit = None, oldest_first = True):
+		yield MessageRecord.from_message(message, own_id)
+
+async def scrollback_messages(page, chunk = None):
+	"""The messages a page holds, oldest first, read a chunk at a time from disk and memory"""
+	if chunk is None:
+		chunk = config.SCROLLBACK_CHUNK
+
+	start = 0
+	while start < page.lines.total:
+		stop = min(start + chunk, page.lines.total)
+		for line in page.lines.read(start, stop):
+			if isinstance(line, MessageRecord) and not line.flags & DELETED:
+				yield line
+		start = stop
+		# Let the UI have a frame in between chunks
+		await asyncio.sleep(0)
+
+def format_text(record):
+	sent = datetime.datetime.fromtimestamp(record.timestamp).strftime("%Y-%m-%d %H:%M:%S")
+	return f'[{sent}] {record.author}: {record.content}\n'
+
+def format_jsonl(record):
+	return json.dumps({
+		'id': record.id,
+		'author': record.author,
+		'timestamp': record.timestamp,
+		'content': record.content,
+	}) + '\n'
+
+FORMATS = {
+	'text': format_text,
+	'jsonl': format_jsonl,
+}
+
+async def export(records, path, fmt, on_progress = None, buffer_size = None):
+	"""Write records to path, buffering at most about buffer_size characters. Returns the number written."""
+	if buffer_size is None:
+		buffer_size = config.EXPORT_BUFFER_SIZE
+
+	formatter = FORMATS[fmt]
+	count = 0
+	buffer = []
+	buffered = 0
+	with open(path, 'w') as f:
+		async for record in records:
+			line = formatter(record)
+			buffer.append(line)
+			buffered += len(line)
+			count += 1
+
+			if buffered >= buffer_size:
+				f.write(''.join(buffer))
+				buffer.clear()
+				buffered = 0
+				if on_progress:
+					on_progress(count)
+				await asyncio.sleep(0)
+
+		f.write(''.join(buffer))
+	return count
+
+def start_export(state, page, path, fmt, source):
+	"""Export a channel page in the background, with progress in the modal"""
+	name = page.channel.name
+	if source == 'api':
+		records = api_messages(page.channel, page.bot.user.id)
+	else:
+		records = scrollback_messages(page)
+
+	def on_progress(count):
+		state.modal.set(2, 0, f"Exporting #{name}: {count} messages")
+
+	async def run():
+		try:
+			count = await export(records, path, fmt, on_progress)
+			state.modal.set(2, 0, f"Exported {count} messages from #{name} to {path}", timeout = 5)
+		except Exception as e:
+			logging.error(e)
+			state.modal.set(2, 0, f"<r>Export of #{name} failed<r>: {e}", timeout = 5)
+
+	task = asyncio.create_task(run())
+	_tasks.add(task)
+	task.add_done_callback(_tasks.discard)
+	return task
@@ -0,0 +1,58 @@
+import asyncio
+import collections
+
+class IngestQueue:
+	"""Bounded queue between the gateway event handlers and the pages.
+
+	Handlers only put events in. The UI loop takes them out in batches, once
+	per frame, so formatting and layout never run inside event dispatch. When
+	the queue is full put() waits up to `timeout` seconds for room, then drops
+	the event.
+	"""
+	def __init__(self, capacity, timeout = 0, on_put = None):
+		self.capacity = capacity
+		self.timeout = timeout
+		self.on_put = on_put
+
+		self._items = collections.deque()
+		self._room = asyncio.Event()
+
+		# Largest number of messages that were ever waiting at once
+		self.high_water = 0
+		# Number of puts that had to wait for room, and the ones that gave up
+		self.waited = 0
+		self.dropped = 0
+
+	def __len__(self):
+		return len(self._items)
+
+	async def put(self, item):
+		"""Queue an item. Returns False if it was dropped."""
+		if len(self._items) >= self.capacity:
+			self.waited += 1
+			loop = asyncio.get_running_loop()
+			deadline = loop.time() + self.timeout
+			while len(self._items) >= self.capacity:
+				remaining = deadline - loop.time()
+				if remaining <= 0:
+					self.dropped += 1
+					return False
+
+				self._room.clear()
+				try:
+					await asyncio.wait_for(self._room.wait(), remaining)
+				except asyncio.TimeoutError:
+					pass
+
+		self._items.append(item)
+		self.high_water = max(self.high_water, len(self._items))
+		if self.on_put:
+			self.on_put()
+		return True
+
+	def drain(self, limit):
+		"""Take up to limit items out, oldest first"""
+		batch = [self._items.popleft() for _ in range(min(limit, len(self._items)))]
+		if batch:
+			self._room.set()
+		return batch
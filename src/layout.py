@@ -0,0 +1,236 @@
+import sys
+
+import text
+
+def wrap_line(line, width):
+	return text.wrap(line, width)
+
+class FenwickTree:
+	"""Prefix sums over a list of counts, with O(log n) appends, updates and searches"""
+	def __init__(self, values = ()):
+		self.total = 0
+		self.rebuild(values)
+
+	def __len__(self):
+		return len(self._tree) - 1
+
+	def rebuild(self, values):
+		# 1-based, _tree[i] holds the sum of the values in (i - lowbit(i), i]
+		self._tree = [0]
+		self._tree.extend(values)
+		self.total = sum(self._tree)
+		n = len(self._tree)
+		for i in range(1, n):
+			parent = i + (i & -i)
+			if parent < n:
+				self._tree[parent] += self._tree[i]
+
+	def append(self, value):
+		n = len(self._tree)
+		node = value
+		i = n - 1
+		stop = n - (n & -n)
+		while i > stop:
+			node += self._tree[i]
+			i -= i & -i
+		self._tree.append(node)
+		self.total += value
+
+	def add(self, idx, delta):
+		self.total += delta
+		i = idx + 1
+		while i < len(self._tree):
+			self._tree[i] += delta
+			i += i & -i
+
+	def prefix(self, idx):
+		"""Sum of the first idx values"""
+		total = 0
+		while idx > 0:
+			total += self._tree[idx]
+			idx -= idx & -idx
+		return total
+
+	def search(self, target):
+		"""Returns (idx, remainder) where idx is the first value whose prefix sum exceeds target"""
+		pos = 0
+		step = 1 << (len(self._tree) - 1).bit_length()
+		while step:
+			nxt = pos + step
+			if nxt < len(self._tree) and self._tree[nxt] <= target:
+				pos = nxt
+				target -= self._tree[nxt]
+			step >>= 1
+		return pos, target
+
+class WrapIndex:
+	"""The wrapped (visual) rows of a list of logical lines.
+
+	Rows are kept per logical line, with a prefix sum of row counts, so appending
+	a line only wraps that line and any row can be mapped back to the logical
+	line it came from.
+
+	When the width changes nothing is rewrapped straight away. reflow() rewraps
+	a bounded number of lines per call, starting from the line given to resize()
+	and working outwards, so it can be spread across frames.
+	"""
+	def __init__(self, width = 0, wrap = wrap_line):
+		self.width = width
+		self.wrap = wrap
+
+		self._rows = []
+		# The width each line was last wrapped at
+		self._widths = []
+		self._counts = FenwickTree()
+		# Rough size in bytes of every row held, for the :perf overlay. Kept up to date as rows come and go.
+		self.row_bytes = 0
+
+		# Lines in [_lo, _hi) have been rewrapped since the last resize
+		self._lo = self._hi = 0
+		self.reflowing = False
+
+	def __len__(self):
+		return self._counts.total
+
+	@property
+	def line_count(self):
+		return len(self._rows)
+
+	def _wrap(self, line):
+		# Nothing can be wrapped until we know the width
+		if self.width > 0:
+			return self.wrap(line, self.width)
+		return []
+
+	@staticmethod
+	def _size(rows):
+		return sum(map(sys.getsizeof, rows))
+
+	def append(self, line):
+		rows = self._wrap(line)
+		self.row_bytes += self._size(rows)
+		self._rows.append(rows)
+		self._widths.append(self.width)
+		self._counts.append(len(rows))
+
+	def prepend(self, lines):
+		"""Wrap lines that come before everything in the index. Returns the number of rows added."""
+		rows = [self._wrap(line) for line in lines]
+		self.row_bytes += sum(map(self._size, rows))
+		self._rows[:0] = rows
+		self._widths[:0] = [self.width] * len(rows)
+		self._lo += len(rows)
+		self._hi += len(rows)
+
+		before = len(self)
+		self._counts.rebuild(len(r) for r in self._rows)
+		return len(self) - before
+
+	def drop_front(self, n):
+		"""Forget the first n logical lines. Returns the number of rows removed."""
+		before = len(self)
+		self.row_bytes -= sum(map(self._size, self._rows[:n]))
+		del self._rows[:n]
+		del self._widths[:n]
+		self._lo = max(0, self._lo - n)
+		self._hi = max(0, self._hi - n)
+
+		self._counts.rebuild(len(r) for r in self._rows)
+		return before - len(self)
+
+	def drop_back(self, n):
+		"""Forget the last n logical lines. Returns the number of rows removed."""
+		if n <= 0:
+			return 0
+
+		before = len(self)
+		self.row_bytes -= sum(map(self._size, self._rows[-n:]))
+		del self._rows[-n:]
+		del self._widths[-n:]
+		self._lo = min(self._lo, len(self._rows))
+		self._hi = min(self._hi, len(self._rows))
+		self.reflowing = self._lo > 0 or self._hi < len(self._rows)
+
+		self._counts.rebuild(len(r) for r in self._rows)
+		return before - len(self)
+
+	def rebuild(self, lines, width):
+		self.width = width
+		self._rows = []
+		self._widths = []
+		self._counts.rebuild(())
+		self.row_bytes = 0
+		self.reflowing = False
+		for line in lines:
+			self.append(line)
+
+	def resize(self, width, anchor_line = 0):
+		"""Change the width. Lines are rewrapped by reflow(), starting from anchor_line."""
+		self.width = width
+		self._lo = self._hi = min(max(0, anchor_line), len(self._rows))
+		self.reflowing = bool(self._rows)
+
+	def _rewrap(self, lines, idx):
+		# Lines appended or paged in since the resize are already at the new width
+		if self._widths[idx] == self.width:
+			return
+
+		rows = self._wrap(lines[idx])
+		self._counts.add(idx, len(rows) - len(self._rows[idx]))
+		self.row_bytes += self._size(rows) - self._size(self._rows[idx])
+		self._rows[idx] = rows
+		self._widths[idx] = self.width
+
+	def reflow(self, lines, budget):
+		"""Rewrap up to `budget` lines, alternating below and above the anchor"""
+		n = len(self._rows)
+		while budget > 0 and (self._lo > 0 or self._hi < n):
+			if self._hi < n:
+				self._rewrap(lines, self._hi)
+				self._hi += 1
+				budget -= 1
+
+			if self._lo > 0 and budget > 0:
+				self._lo -= 1
+				self._rewrap(lines, self._lo)
+				budget -= 1
+
+		self.reflowing = self._lo > 0 or self._hi < n
+
+	def update(self, idx, line):
+		"""Rewrap a single line whose content changed, in O(log n). Returns the change in rows."""
+		rows = self._wrap(line)
+		delta = len(rows) - len(self._rows[idx])
+		self._counts.add(idx, delta)
+		self.row_bytes += self._size(rows) - self._size(self._rows[idx])
+		self._rows[idx] = rows
+		self._widths[idx] = self.width
+		return delta
+
+	def line_rows(self, idx):
+		"""The (start, end) row range of logical line idx"""
+		start = self._counts.prefix(idx)
+		return start, start + len(self._rows[idx])
+
+	def rows_of(self, idx):
+		return self._rows[idx]
+
+	def locate(self, row):
+		"""The (logical line, row within that line) a row belongs to"""
+		if row >= len(self):
+			idx = len(self._rows) - 1
+			return idx, max(0, len(self._rows[idx]) - 1) if idx >= 0 else 0
+		return self._counts.search(row)
+
+	def slice(self, start, stop):
+		"""Rows [start, stop), in O(log n + stop - start)"""
+		if stop <= start or start >= len(self):
+			return []
+
+		idx, offset = self._counts.search(start)
+		rows = self._rows[idx][offset:offset + stop - start]
+		idx += 1
+		while len(rows) < stop - start and idx < len(self._rows):
+			rows.extend(self._rows[idx][:stop - start - len(rows)])
+			idx += 1
+		return rows
@@ -3,10 +3,14 @@ import asyncio
 import discord 
 import signal 
 import logging
+import sys
+import os
 
 import text
 from state import State
+from render import Renderer, CursesBackend
 from client import Vuut
+from replay import Recorder, ReplayClient
 
 import config 
 
@@ -16,12 +20,42 @@ from colors import *
 
 import modules
 
-async def run_curses_ui(stdscr, state):
-	global WINDOW_MAX_X, WINDOW_MAX_Y, OUTPUT_HEIGHT
+def handle_key(state, ch):
+	"""Applies a single keypress to the state"""
+	ESCAPE = "\x1b"
+	if ch == '\n':
+		state.handle_input(state.input)
+	elif ch in ('\b', '\x7f', curses.KEY_BACKSPACE):
+		state.input = state.input[:-1]
+	elif ch == ESCAPE:
+		state.input = ''
+		if not state.process_commands:
+			state.modal.set(0, 0, "COMMAND MODE")
+		else:
+			state.modal.set(0, 0, '')
+		state.process_commands = not state.process_commands
+
+	elif isinstance(ch, str) and ch.isprintable():
+		state.input += ch
+	elif ch == curses.KEY_UP:
+		state.pageman.focus.on_scroll_up()
+	elif ch == curses.KEY_DOWN:
+		state.pageman.focus.on_scroll_down()
+	elif ch == curses.KEY_PPAGE:
+		state.pageman.focus.on_page_up()
+	elif ch == curses.KEY_NPAGE:
+		state.pageman.focus.on_page_down()
+	elif ch == curses.KEY_HOME:
+		state.pageman.focus.on_home()
+	elif ch == curses.KEY_END:
+		state.pageman.focus.on_end()
 
+async def run_curses_ui(stdscr, state):
 	curses.curs_set(1)
+	# Never block on input, keys are read when the terminal says there are some
 	stdscr.nodelay(True)
-	stdscr.timeout(100)
+	# Don't hang for a second after ESC waiting for the rest of an escape sequence
+	curses.set_escdelay(25)
    
 	curses.start_color()
 	curses.use_default_colors()
@@ -30,91 +64,69 @@ async def run_curses_ui(stdscr, state):
 	curses.init_pair(RED, curses.COLOR_RED, -1)
 	curses.init_pair(YELLOW, curses.COLOR_YELLOW, -1)
 
-	buffer = ''
-	while True:
-		try:
-			ch = stdscr.get_wch()
-			if ch == -1:
-				continue
-
-			ESCAPE = "\x1b"
-			if ch == '\n':
-				state.handle_input(buffer)
-				buffer = ''
-			elif ch in ('\b', '\x7f', curses.KEY_BACKSPACE):
-				buffer = buffer[:-1]
-			elif ch == ESCAPE:
-				buffer = ''
-				if not state.process_commands:
-					state.modal.set(0, 0, "COMMAND MODE")
-				else:
-					state.modal.set(0, 0, '')
-				state.process_commands = not state.process_commands
-
-			elif isinstance(ch, str) and ch.isprintable():
-				buffer += ch
-			elif ch == curses.KEY_UP:
-				state.pageman.focus.on_scroll_up()
-			elif ch == curses.KEY_DOWN:
-				state.pageman.focus.on_scroll_down()
-
-		except curses.error:
-			pass
-
-		WINDOW_MAX_Y, WINDOW_MAX_X = stdscr.getmaxyx()
-		OUTPUT_HEIGHT = WINDOW_MAX_Y - INPUT_HEIGHT - MODAL_HEIGHT
-
-		# Gotta do some monkey business here
-		config.WINDOW_MAX_X = WINDOW_MAX_X
-		config.WINDOW_MAX_Y = WINDOW_MAX_Y
-		config.OUTPUT_HEIGHT = OUTPUT_HEIGHT
-
-		# Modal window
-		modal_win = curses.newwin(MODAL_HEIGHT, WINDOW_MAX_X, 0,0)
-		modal_win.erase()
-
-		modal_lines = state.modal.lines
-		if len(modal_lines) > MODAL_HEIGHT - 2*int(MODAL_BORDER_ENABLED):
-			modal_lines = [f"Cannot render modal : Too many lines ({len(modal_lines)})"]
-
-		for idx, line in enumerate(modal_lines):
-			text.render_text_line(modal_win, idx + int(MODAL_BORDER_ENABLED), 1, line.get_renderable(WINDOW_MAX_X - 2),)
-
-		modal_win.border()
-		modal_win.refresh()
-
-		# Output window
-		output_win = curses.newwin(OUTPUT_HEIGHT, WINDOW_MAX_X, MODAL_HEIGHT, 0)
-		output_win.erase()
-
-		output = state.output()
-		output_lines = output.splitlines()
-		for idx, line in enumerate(output_lines[-(OUTPUT_HEIGHT- int(OUTPUT_BORDER_ENABLED)):]):
-			text.render_text_line(output_win, idx + int(OUTPUT_BORDER_ENABLED), 1, line)
-
-		output_win.border()
-		output_win.refresh()
-
-		# Input window
-		input_win = curses.newwin(INPUT_HEIGHT, WINDOW_MAX_X, WINDOW_MAX_Y - INPUT_HEIGHT, 0)
-		input_win.scrollok(True)
-		input_win.erase()
-
-		input_win.border()
-		input_win.addstr(1, 1, buffer[-(WINDOW_MAX_X - 2):])
-		input_win.refresh()
-
-		state.on_screen_update(stdscr.getmaxyx(), OUTPUT_HEIGHT)
-
-		await asyncio.sleep(0.01)
+	loop = asyncio.get_running_loop()
+	resized = True
+
+	def on_stdin():
+		while True:
+			try:
+				ch = stdscr.get_wch()
+			except curses.error:
+				break
+
+			if ch == curses.KEY_RESIZE:
+				on_resize()
+			else:
+				handle_key(state, ch)
+		state.scheduler.mark_dirty()
+
+	def on_resize():
+		nonlocal resized
+		resized = True
+		state.scheduler.mark_dirty()
+
+	stdin_fd = sys.stdin.fileno()
+	loop.add_reader(stdin_fd, on_stdin)
+	# Since nothing is polling getch, curses won't notice a resize on its own
+	loop.add_signal_handler(signal.SIGWINCH, on_resize)
+
+	renderer = Renderer(CursesBackend())
+	try:
+		while True:
+			if resized:
+				resized = False
+				width, height = os.get_terminal_size(stdin_fd)
+				curses.resizeterm(height, width)
+				renderer.resize(height, width)
+				state.scheduler.mark_dirty()
+
+			# Clock and modal timeouts mark the state dirty themselves
+			state.tick()
+
+			if state.scheduler.consume():
+				renderer.draw(state)
+
+			# Sleep until something changes, or until the clock or a modal timeout is due
+			await state.scheduler.wait(state.next_wakeup())
+	finally:
+		loop.remove_reader(stdin_fd)
+		loop.remove_signal_handler(signal.SIGWINCH)
 
 async def noop():
 	42
 
 async def main():
 	state = State()
-	intents = discord.Intents.all()
-	bot = Vuut(state, intents=intents)
+	if config.REPLAY_PATH:
+		# Stands in for the client and never touches the network
+		bot = ReplayClient(state)
+		session = bot.replay(config.REPLAY_PATH, config.REPLAY_SPEED)
+	else:
+		intents = discord.Intents.all()
+		bot = Vuut(state, intents=intents)
+		session = bot.start(DISCORD_TOKEN) if config.START_BOT else noop()
+		if config.RECORD_PATH:
+			state.recorder = Recorder(config.RECORD_PATH)
 
 	state.load_module(modules.Core(state.parser, state, bot))
 	loop = asyncio.get_event_loop()
@@ -127,6 +139,13 @@ async def main():
 
 	# Handle cleanup gracefully
 	def shutdown():
+		state.prefetcher.cancel()
+		state.notifier.cancel()
+		if state.recorder is not None:
+			state.recorder.close()
+		if state.store is not None:
+			state.store.close()
+
 		curses.nocbreak()
 		stdscr.keypad(False)
 		curses.echo()
@@ -138,7 +157,7 @@ async def main():
 
 	try:
 		await asyncio.gather(
-			bot.start(DISCORD_TOKEN) if config.START_BOT else noop(),
+			session,
 			run_curses_ui(stdscr, state)
 		)
 	finally:
@@ -0,0 +1,72 @@
+import config
+import utils
+
+from text import Text, truncate, with_prefix, wrap
+
+# Message flags
+OWN = 1
+EDITED = 2
+DELETED = 4
+
+class MessageRecord:
+	"""A chat message as a page keeps it.
+
+	Nothing about the screen is stored, the rows are only formatted when the
+	page needs them, at whatever width it is wrapping to. The rows for the
+	last width are kept, so drawing the same message again is free.
+	"""
+	__slots__ = ('id', 'author', 'timestamp', 'content', 'flags', '_rendered')
+
+	def __init__(self, id, author, timestamp, content, flags = 0):
+		self.id = id
+		self.author = author
+		self.timestamp = timestamp
+		self.content = content
+		self.flags = flags
+		self._rendered = None
+
+	@classmethod
+	def from_message(cls, message, own_id):
+		flags = OWN if message.author.id == own_id else 0
+		return cls(message.id, message.author.display_name, message.created_at.timestamp(), message.content, flags)
+
+	def render(self, width):
+		"""The rows of the message at a given width, with the time and author in front of the first one"""
+		if self._rendered is not None and self._rendered[0] == width:
+			return self._rendered[1]
+
+		# Deleted messages stay in the page, but take up no rows
+		if self.flags & DELETED:
+			return []
+
+		clockmsg = utils.get_clock_time(int(self.timestamp))
+		# Long display names are cut short so the prefix keeps its width, with a space after the time
+		author_name = Text(truncate(self.author, config.PREFIX_LEN - 3 - clockmsg.size - 1))
+		fmt_tags = []
+		if not self.flags & OWN:
+			fmt_tags.append("**")
+			author_name = Text("**" + author_name + "**")
+
+		# Very narrow windows still get one cell per row for the content
+		rows = wrap(self.content, max(1, width - config.PREFIX_LEN))
+		rows = [
+			with_prefix(Text(row), clockmsg, author_name, config.PREFIX_LEN, idx == 0, fmt_tags)
+			for idx, row in enumerate(rows or [''])
+		]
+
+		self._rendered = (width, rows)
+		return rows
+
+	def edited(self, content):
+		"""A copy of the message with new content"""
+		return MessageRecord(self.id, self.author, self.timestamp, content, self.flags | EDITED)
+
+	def deleted(self):
+		return MessageRecord(self.id, self.author, self.timestamp, '', self.flags | DELETED)
+
+	def to_json(self):
+		return [self.id, self.author, self.timestamp, self.content, self.flags]
+
+	@classmethod
+	def from_json(cls, fields):
+		return cls(*fields)
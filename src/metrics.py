@@ -0,0 +1,122 @@
+import asyncio
+import collections
+import json
+import time
+
+def percentile(samples, p):
+	if not samples:
+		return 0
+	samples = sorted(samples)
+	return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+def page_memory(page):
+	"""Rough size in bytes of the lines and wrapped rows a page holds in memory, from the counts they keep"""
+	size = getattr(getattr(page, 'lines', None), 'line_bytes', 0)
+
+	index = getattr(page, 'index', None)
+	if index is not None:
+		size += index.row_bytes
+	return size
+
+class Metrics:
+	"""Performance counters behind the :perf overlay.
+
+	Frame timings are always recorded, since that is only a couple of clock reads
+	per frame. Loop lag is only sampled while the overlay is on.
+	"""
+	def __init__(self, window = 300):
+		self.layout_times = collections.deque(maxlen = window)
+		self.render_times = collections.deque(maxlen = window)
+		self.frame_times = collections.deque(maxlen = window)
+		self.loop_lag = collections.deque(maxlen = window)
+
+		self.messages = 0
+		self.message_rate = 0
+		self._rate_sample = (time.monotonic(), 0)
+
+		self.enabled = False
+		self._lag_task = None
+
+	def record_frame(self, layout, render):
+		self.layout_times.append(layout)
+		self.render_times.append(render)
+		self.frame_times.append(layout + render)
+
+	def record_message(self):
+		self.messages += 1
+
+	def update_rate(self):
+		curtime = time.monotonic()
+		last_time, last_count = self._rate_sample
+		if curtime > last_time:
+			self.message_rate = (self.messages - last_count) / (curtime - last_time)
+		self._rate_sample = (curtime, self.messages)
+
+	async def monitor_lag(self, interval = 0.25):
+		"""Measure how late the event loop wakes us up compared to when we asked"""
+		while True:
+			start = time.monotonic()
+			await asyncio.sleep(interval)
+			self.loop_lag.append(max(0, time.monotonic() - start - interval))
+
+	def toggle(self):
+		self.enabled = not self.enabled
+		if self.enabled:
+			self._lag_task = asyncio.create_task(self.monitor_lag())
+		elif self._lag_task:
+			self._lag_task.cancel()
+			self._lag_task = None
+		return self.enabled
+
+	def summary(self, page = None, scheduler = None, ingest_queue = None):
+		res = {
+			'frame_p50_ms': percentile(self.frame_times, 0.5) * 1e3,
+			'frame_p99_ms': percentile(self.frame_times, 0.99) * 1e3,
+			'layout_p50_ms': percentile(self.layout_times, 0.5) * 1e3,
+			'render_p50_ms': percentile(self.render_times, 0.5) * 1e3,
+			'loop_lag_p99_ms': percentile(self.loop_lag, 0.99) * 1e3,
+			'messages': self.messages,
+			'messages_per_second': self.message_rate,
+		}
+
+		if scheduler is not None:
+			res['frames'] = scheduler.frames
+			res['throttled_frames'] = scheduler.throttled
+
+		if ingest_queue is not None:
+			res['ingest_queued'] = len(ingest_queue)
+			res['ingest_high_water'] = ingest_queue.high_water
+			res['ingest_waited'] = ingest_queue.waited
+			res['ingest_dropped'] = ingest_queue.dropped
+
+		index = getattr(page, 'index', None)
+		if index is not None:
+			res['logical_lines'] = index.line_count
+			res['wrapped_rows'] = len(index)
+			res['scrollback_bytes'] = page_memory(page)
+		return res
+
+	def overlay(self, page = None, scheduler = None, ingest_queue = None):
+		"""The (left, center, right) modal elements for the overlay"""
+		s = self.summary(page, scheduler, ingest_queue)
+		left = f"frame {s['frame_p50_ms']:.1f}/{s['frame_p99_ms']:.1f}ms (layout {s['layout_p50_ms']:.1f} render {s['render_p50_ms']:.1f})"
+		center = f"lag {s['loop_lag_p99_ms']:.0f}ms  {s['messages_per_second']:.1f} msg/s"
+		if 'ingest_queued' in s:
+			center += f"  queue {s['ingest_queued']} drop {s['ingest_dropped']}"
+		right = ''
+		if 'wrapped_rows' in s:
+			right = f"{s['wrapped_rows']} rows  {s['scrollback_bytes'] // 1024}KiB"
+		return left, center, right
+
+	def dump(self, path, page = None, scheduler = None, ingest_queue = None):
+		"""Append the current counters, and the raw frame samples, to a JSON lines file"""
+		record = {
+			'time': time.time(),
+			'summary': self.summary(page, scheduler, ingest_queue),
+			'frame_times': list(self.frame_times),
+			'layout_times': list(self.layout_times),
+			'render_times': list(self.render_times),
+			'loop_lag': list(self.loop_lag),
+		}
+		with open(path, 'a') as f:
+			f.write(json.dumps(record) + '\n')
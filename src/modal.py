@@ -1,5 +1,6 @@
-from text import strip_wrappers as stripw
+from text import clean_width
 import time
+import heapq
 
 class ModalLine:
 	"""Intelligent modal line rendering"""
@@ -11,6 +12,8 @@ class ModalLine:
 		while len(self.elements) < 3:
 			self.elements.append('')
 
+		self._rendered = None
+
 	@property
 	def left(self):
 		return self.elements[0]
@@ -36,72 +39,116 @@ class ModalLine:
 		self.elements[2] = w
 
 	def get_renderable(self, max_length):
+		# The same line gets rendered on every frame, so remember the last result
+		key = (tuple(self.elements), max_length)
+		if self._rendered is not None and self._rendered[0] == key:
+			return self._rendered[1]
+
+		renderable = self.render(max_length)
+		self._rendered = (key, renderable)
+		return renderable
+
+	def render(self, max_length):
 		elements = [str(element) for element in self.elements]
+		widths = [clean_width(element) for element in elements]
 		n = max_length
 
 		# Keep removing until we are happy. Removal priority is 1 > 0 > 2
-		while (sum([len(stripw(l)) for l in elements]) >= max_length):
+		while (sum(widths) >= max_length):
 			match len(elements):
 				case 1:
 					elements = []
+					widths = []
 				case 2:
 					elements.pop()
+					widths.pop()
 				case 3:
 					elements.pop(1)
+					widths.pop(1)
 
 		if not elements:
 			return ' ' * n
 
 		if len(elements) == 1:
-			stripped = stripw(elements[0])
-			mid = (n - len(stripped)) // 2
+			width = widths[0]
+			mid = (n - width) // 2
 			left = ' ' * mid
-			right = ' ' * (n - mid - len(stripped))
+			right = ' ' * (n - mid - width)
 			return left + elements[0] + right
 
 		if len(elements) == 2:
 			left_elem, right_elem = elements
-			middle_space = n - len(stripw(left_elem)) - len(stripw(right_elem))
+			middle_space = n - sum(widths)
 			return left_elem + (' ' * middle_space) + right_elem
 
 		if len(elements) == 3:
 			e1, e2, e3 = elements
-			total_len = sum([len(stripw(l)) for l in elements])
+			total_len = sum(widths)
 			total_spaces = n - total_len
 			gap1 = total_spaces // 2
 			gap2 = total_spaces - gap1
 			return e1 + ' ' * gap1 + e2 + ' ' * gap2 + e3
 
 class Modal:
-	def __init__(self, max_lines, lines = []):
+	def __init__(self, max_lines, lines = None, on_change = None):
 		self.max_lines = max_lines
+		if lines is None:
+			lines = []
 		self.lines = lines
 		while (len(lines) < max_lines):
 			lines.append(ModalLine())
 
+		# Called whenever the modal content changes, so the UI knows it has to redraw
+		self.on_change = on_change
+
+		# When each slot should be cleared, and a heap of (time, line, idx) so the
+		# next one to go can be found without looking at every slot.
+		# Heap entries whose time no longer matches _remove_on are stale and skipped.
 		self._remove_on = []
 		for i in range(max_lines):
 			self._remove_on.append([None, None, None])
+		self._timers = []
+
+	@property
+	def next_expiry(self):
+		"""The time at which the next slot will be cleared, or None"""
+		while self._timers:
+			end_time, line, idx = self._timers[0]
+			if self._remove_on[line][idx] == end_time:
+				return end_time
+			heapq.heappop(self._timers)
+		return None
 
 	def on_screen_update(self):
 		curtime = time.time()
-		for i in range(self.max_lines):
-			for j in range(3):
-				if self._remove_on[i][j] and curtime >= self._remove_on[i][j]:
-					self.set(i, j, '')
-					self._remove_on[i][j] = None
+		while self._timers and self._timers[0][0] <= curtime:
+			end_time, line, idx = heapq.heappop(self._timers)
+			if self._remove_on[line][idx] == end_time:
+				self.set(line, idx, '')
+
+	def changed(self):
+		if self.on_change:
+			self.on_change()
+
+	def _set_timeout(self, line, idx, end_time):
+		self._remove_on[line][idx] = end_time
+		if end_time is not None:
+			heapq.heappush(self._timers, (end_time, line, idx))
 
 	def set(self, line, idx, text, timeout = None):
-		self.lines[line].elements[idx] = text
+		if self.lines[line].elements[idx] != text:
+			self.lines[line].elements[idx] = text
+			self.changed()
 
-		curtime = time.time()
-		self._remove_on[line][idx] = curtime + timeout if timeout else None
+		self._set_timeout(line, idx, time.time() + timeout if timeout else None)
 
 	def set_line(self, line, modal_line : ModalLine, timeout = None):
 		self.lines[line] = modal_line
+		self.changed()
 
 		end_time = time.time() + timeout if timeout else None
-		self._remove_on[line] = [end_time, end_time, end_time]
+		for idx in range(3):
+			self._set_timeout(line, idx, end_time)
 	
 	def get(self, line, idx):
 		return self.lines[line].elements[idx]
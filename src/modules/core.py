@@ -1,6 +1,9 @@
 import cmdlib
 import logging
 import page
+import config
+import utils
+import export
 
 class Core(cmdlib.Module):
 	def __init__(self, parser, state, bot):
@@ -35,6 +38,58 @@ class Core(cmdlib.Module):
 
 		ctx.state.pageman.set_focus(ctx.page.on_select(idx), parent = ctx.page)
 
+	@cmdlib.command(name = 'search', aliases = ['find'])
+	def search(self, ctx, query):
+		"""List the messages in open channels and the local history that contain every word of the query"""
+		hits = ctx.state.pageman.search(query, config.SEARCH_RESULTS_LIMIT)
+		results = page.SearchResultsPage(ctx.state.pageman, query, hits, window_dimensions = ctx.state.window_dimensions)
+		ctx.state.pageman.set_focus(results, parent = ctx.page)
+
+	@cmdlib.command(name = 'jump', aliases = ['j'])
+	def jump(self, ctx, when):
+		"""Scroll to the first message at or after a time: 14:30, 31/01/24, 2024-01-31, or 2h for two hours ago"""
+		if not isinstance(ctx.page, page.ChannelChatPage):
+			return
+
+		try:
+			timestamp = utils.parse_time(when)
+		except ValueError as e:
+			ctx.state.modal.set(2, 0, str(e), timeout = 3)
+			return
+
+		if not ctx.page.jump_to_time(timestamp):
+			ctx.state.modal.set(2, 0, f"No messages after {when}", timeout = 3)
+
+	@cmdlib.add_flag(name = "format", default = "text")
+	@cmdlib.add_flag(name = "source", default = "api")
+	@cmdlib.command(name = 'export')
+	def export_channel(self, ctx, path):
+		"""Write the channel's history to a file in the background. -format text|jsonl, -source api|local"""
+		if not isinstance(ctx.page, page.ChannelChatPage):
+			return
+
+		if ctx.flags.format not in export.FORMATS or ctx.flags.source not in ('api', 'local'):
+			ctx.state.modal.set(2, 0, "Export takes -format text|jsonl and -source api|local", timeout = 3)
+			return
+
+		export.start_export(ctx.state, ctx.page, path, ctx.flags.format, ctx.flags.source)
+
+	@cmdlib.command(name = 'frames')
+	def frames(self, ctx):
+		scheduler = ctx.state.scheduler
+		ctx.state.modal.set(2, 0, f"Frames: {scheduler.frames} Throttled: {scheduler.throttled}", timeout = 5)
+
+	@cmdlib.command(name = 'perf')
+	def perf(self, ctx):
+		"""Toggle the performance overlay in the modal"""
+		ctx.state.toggle_perf_overlay()
+
+	@cmdlib.command(name = 'perfdump')
+	def perfdump(self, ctx, path = 'perf.jsonl'):
+		"""Append the performance counters to a file"""
+		ctx.state.metrics.dump(path, ctx.page, ctx.state.scheduler, ctx.state.ingest_queue)
+		ctx.state.modal.set(2, 1, f"Counters written to {path}", timeout = 3)
+
 	@cmdlib.command(name = 'back', aliases = ['b'])
 	def back(self, ctx):
 		ctx.state.pageman.go_back()
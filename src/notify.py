@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import os
+import time
+
+class NotifySendBackend:
+	"""Desktop notifications through notify-send. Arguments are passed straight to
+	the process, no shell is involved, and `--` keeps a title or body that
+	starts with - from being read as an option."""
+	def __init__(self, urgency = 'critical'):
+		self.urgency = urgency
+
+	async def send(self, title, body):
+		process = await asyncio.create_subprocess_exec(
+			'notify-send', '-u', self.urgency, '--', title, body,
+			stdout = asyncio.subprocess.DEVNULL,
+			stderr = asyncio.subprocess.DEVNULL,
+		)
+		await process.wait()
+
+class NullBackend:
+	"""Drops every notification"""
+	async def send(self, title, body):
+		pass
+
+def get_backend(name):
+	if name == 'notify-send' and os.name == 'posix':
+		return NotifySendBackend()
+	return NullBackend()
+
+class Notifier:
+	"""Sends desktop notifications without holding up the event loop.
+
+	Each key, usually a user, gets at most one notification every `interval`
+	seconds. Notifications are held for `window` seconds so a burst can be
+	looked at as a whole: up to `burst` of them are sent one by one, anything
+	bigger is sent as a single summary.
+	"""
+	def __init__(self, backend, interval = 60, window = 1, burst = 3):
+		self.backend = backend
+		self.interval = interval
+		self.window = window
+		self.burst = burst
+
+		self._pending = []
+		self._last_sent = {}
+		self._task = None
+
+		self.sent = 0
+		self.limited = 0
+
+	def notify(self, key, title, body):
+		curtime = time.monotonic()
+		if curtime - self._last_sent.get(key, -self.interval) < self.interval:
+			self.limited += 1
+			return
+
+		self._last_sent[key] = curtime
+		# Forget keys that can no longer be limited, so this doesn't grow with every user ever seen
+		if len(self._last_sent) > 1024:
+			self._last_sent = {k: t for k, t in self._last_sent.items() if curtime - t < self.interval}
+
+		self._pending.append((title, body))
+		if self._task is None:
+			self._task = asyncio.create_task(self.run())
+
+	async def run(self):
+		try:
+			while self._pending:
+				await asyncio.sleep(self.window)
+				batch, self._pending = self._pending, []
+				if len(batch) <= self.burst:
+					for title, body in batch:
+						await self.send(title, body)
+				else:
+					shown = '\n'.join(body for title, body in batch[:self.burst])
+					await self.send(f"{len(batch)} updates", f"{shown}\nand {len(batch) - self.burst} more")
+		finally:
+			self._task = None
+
+	async def send(self, title, body):
+		try:
+			await self.backend.send(title, body)
+			self.sent += 1
+		except Exception as e:
+			logging.error(e)
+
+	def cancel(self):
+		if self._task is not None:
+			self._task.cancel()
+			self._task = None
@@ -1,17 +1,30 @@
-import math
 import config 
-import textwrap
 import logging
 import utils
 import asyncio
+import array
+import bisect
+import prefetch
+import text
 
-from text import Text, with_prefix
+from text import Text
+from layout import WrapIndex, wrap_line
+from message import MessageRecord, OWN, DELETED
+from scrollback import Scrollback
+from search import SearchIndex, words
+
+# Shown where a channel's history skips over messages that were never fetched
+SKIPPED_MARKER = "<y>-- Older messages skipped --<y>"
 
 class PageManager:
 	def __init__(self, state, root = None):
 		self.state = state
 		self.pages = []
 		self.channel_pages_mapping = {}
+		# Channels that are known but whose page may not have been built yet
+		self.channels = {}
+		# Called with a channel to build its page, the first time it is needed
+		self.page_factory = None
 		self.focus = None
 		self.root = None
 
@@ -27,27 +40,111 @@ class PageManager:
 		if (teardown and self.focus):
 			self.focus.teardown()
 
+		# Options can be channels, whose page is built on first selection
+		if not isinstance(page, Page):
+			page = self.get_channel_page(page.id)
+
 		self.focus = page
 		self.focus.parent = parent
+		self.focus.on_change = self.on_page_change
 		if hasattr(self.focus, 'opened'):
 			self.focus.on_first_open()
+			self.state.activity.mark_read(self.focus.channel.id)
+
+		self.state.scheduler.mark_dirty()
 
 	def add_page(self, page):
 		self.pages.append(page)
+		page.on_change = self.on_page_change
 		if isinstance(page, ChannelChatPage):
 			self.channel_pages_mapping[page.channel.id] = page
 
-	async def process_message(self, message, show_time = True):
+	def add_channel(self, channel):
+		"""Make a channel known without building a page for it"""
+		self.channels[channel.id] = channel
+
+	def get_channel_page(self, channel_id):
+		"""The page of a channel, built if it does not exist yet. None for unknown channels."""
+		channel_page = self.channel_pages_mapping.get(channel_id)
+		if channel_page is None and channel_id in self.channels and self.page_factory is not None:
+			channel_page = self.page_factory(self.channels[channel_id])
+			self.add_page(channel_page)
+		return channel_page
+
+	def search(self, query, limit):
+		"""The newest `limit` messages that contain every word of the query, from the channel pages
+		and the local history, as (channel, message record) tuples"""
+		terms = set(words(query))
+		hits = {}
+		for channel_page in self.channel_pages_mapping.values():
+			found = 0
+			for line_no in channel_page.search_index.search(query):
+				record = channel_page.lines.get(line_no)
+				# The index still has the words of edited and deleted messages
+				if record.flags & DELETED or not terms <= set(words(record.content)):
+					continue
+				hits[record.id] = (channel_page.channel, record)
+				found += 1
+				if found >= limit:
+					break
+
+		store = self.state.store
+		if store is not None:
+			found = 0
+			for channel_id, message_id, author_id, author_name, timestamp, content in store.search(terms):
+				# The full text index splits words a little differently, so go by ours
+				if channel_id not in self.channels or not terms <= set(words(content)):
+					continue
+				if message_id not in hits:
+					flags = OWN if author_id == self.state.activity.own_id else 0
+					hits[message_id] = (self.channels[channel_id], MessageRecord(message_id, author_name, timestamp, content, flags))
+				found += 1
+				if found >= limit:
+					break
+
+		return sorted(hits.values(), key = lambda hit: hit[1].timestamp, reverse = True)[:limit]
+
+	def apply(self, event):
+		"""Apply an event taken off the ingest queue"""
+		store = self.state.store
+		match event:
+			case ('message', message):
+				self.process_message(message, show_time = True)
+
+			case ('edit', channel_id, message_id, content):
+				if store is not None:
+					store.edit(channel_id, message_id, content)
+				if channel_id in self.channel_pages_mapping:
+					self.channel_pages_mapping[channel_id].edit_message(message_id, content)
+
+			case ('delete', channel_id, message_ids):
+				if store is not None:
+					store.delete(channel_id, message_ids)
+				if channel_id in self.channel_pages_mapping:
+					self.channel_pages_mapping[channel_id].delete_messages(message_ids)
+
+	def process_message(self, message, show_time = True):
+		self.state.metrics.record_message()
 		channel_id = message.channel.id
+
+		# Whatever is not on screen counts as unread, page or no page
+		if not (isinstance(self.focus, ChannelChatPage) and self.focus.channel.id == channel_id):
+			self.state.activity.record(message)
 		if channel_id not in self.channel_pages_mapping.keys():
 			return
 
-		await self.channel_pages_mapping[channel_id].process_message(message, show_time)
-		
+		self.channel_pages_mapping[channel_id].process_message(message, show_time)
+
+	def on_page_change(self, page):
+		# Pages that are not on screen don't need a redraw
+		if page is self.focus:
+			self.state.scheduler.mark_dirty()
+
 class Page:
 	def __init__(self, parent = None, text = '', **kwargs):
 		self.parent = parent
 		self.lines = text.split('\n') if text else []
+		self.on_change = None
 
 	def teardown(self):
 		pass
@@ -61,12 +158,23 @@ class Page:
 
 		return self.parent
 
+	def changed(self):
+		if self.on_change:
+			self.on_change(self)
+
 	def add_line(self, line):
 		self.lines.append(line)
+		self.changed()
 
 	def on_screen_update(self, window_dimensions, output_height):
 		pass
 
+	def get_viewport(self, height):
+		"""The rows that should be on screen, as a sequence. Should only cost O(height)."""
+		if height <= 0:
+			return []
+		return self.lines[-height:]
+
 	def get_renderable(self):
 		pass
 
@@ -76,95 +184,272 @@ class ScrollablePage(Page):
 		self.output_height = 0
 		self.window_dimensions = kwargs.get("window_dimensions", (0, 0))
 
-		self.cur_viewport_lines = self.lines
+		# Capacity of the in-memory scrollback. None keeps every line in memory
+		self.lines = Scrollback(kwargs.get("scrollback", None), self.lines, self.encode_line, self.decode_line)
+		self.index = WrapIndex(wrap = self.wrap_line)
+		self.index.rebuild(self.lines, self.text_width)
 		self.current_scroll_head = 0
 
 	@property
 	def true_output_height(self):
 		return self.output_height - 2*int(config.OUTPUT_BORDER_ENABLED)
 
-	def add_line(self, line):
-		super().add_line(line)
-		self.update_viewport_lines()
+	@property
+	def text_width(self):
+		"""Width, in cells, that lines are wrapped to"""
+		return self.window_dimensions[1] - 2*int(config.OUTPUT_BORDER_ENABLED)
 
-	def get_renderable(self):
-		count = self.true_output_height
+	def wrap_line(self, line, width):
+		"""The rows a logical line takes up at a given width"""
+		return wrap_line(line, width)
 
-		lines = []
-		for i in range(len(self.cur_viewport_lines)):
-			if i < self.current_scroll_head:
-				continue
+	def encode_line(self, line):
+		"""Turn a logical line into something JSON can hold, for the spill file"""
+		return line
+
+	def decode_line(self, data):
+		return data
+
+	def add_line(self, line):
+		# While the window is away from the end, new lines only go to disk
+		if self.lines.attached:
+			self.index.append(line)
+		super().add_line(line)
+		self.trim_scrollback()
 
-			if i > (self.current_scroll_head + self.true_output_height - 1):
-				break
+	def trim_scrollback(self):
+		"""Spill the oldest lines to disk once the page holds too many"""
+		if self.lines.excess < config.SCROLLBACK_CHUNK:
+			return
 
-			lines.append(self.cur_viewport_lines[i])
+		# Never evict anything that is on screen
+		n = min(self.lines.excess, self.get_visible_line())
+		if n > 0:
+			self.lines.evict(n)
+			self.current_scroll_head -= self.index.drop_front(n)
+
+	def page_in(self, n):
+		"""Bring back lines from disk when scrolling past the in-memory window"""
+		self.current_scroll_head += self.index.prepend(self.lines.page_in(n))
+
+		# Scrolling up, so make room by dropping what is below the screen. The window
+		# stops at those lines, and anything newer goes to disk until we scroll back down.
+		if self.lines.excess:
+			below = self.index.locate(max(0, self.current_scroll_head) + self.true_output_height)[0] + 1
+			self.index.drop_back(self.lines.drop_back(min(self.lines.excess, self.index.line_count - below)))
+
+	def page_in_after(self, n):
+		"""Bring back lines from disk when scrolling down past a window that doesn't run to the end"""
+		for line in self.lines.page_in_after(n):
+			self.index.append(line)
+
+	def load_window(self, start):
+		"""Swap the lines in memory for one chunk from start on, without wrapping anything in between"""
+		stop = min(self.lines.total, max(0, start) + config.SCROLLBACK_CHUNK)
+		self.lines.load(max(0, stop - config.SCROLLBACK_CHUNK), stop)
+		self.index.rebuild(self.lines, self.text_width)
+
+	def get_viewport(self, height):
+		# The scroll head goes negative when there are fewer rows than the window can hold
+		start = max(0, self.current_scroll_head)
+		return self.index.slice(start, self.current_scroll_head + height)
 
-		# Only send what output window can display
-		# Just to be safe
-		lines = lines[-self.true_output_height:]
-		return '\n'.join(lines)
+	def get_renderable(self):
+		return '\n'.join(self.get_viewport(self.true_output_height))
 
 	def on_scroll_up(self):
+		if self.current_scroll_head <= 0 and self.lines.base:
+			self.page_in(config.SCROLLBACK_CHUNK)
+
 		self.current_scroll_head = max(0, self.current_scroll_head - 1)
 		# logging.error(self.current_scroll_head)
 
 	def on_scroll_down(self):
-		self.current_scroll_head = min(len(self.cur_viewport_lines) - self.true_output_height, self.current_scroll_head+1)
+		if not self.lines.attached and self.current_scroll_head + self.true_output_height >= len(self.index):
+			self.page_in_after(config.SCROLLBACK_CHUNK)
+
+		self.current_scroll_head = min(len(self.index) - self.true_output_height, self.current_scroll_head+1)
+		self.trim_scrollback()
 		# logging.error(self.current_scroll_head)
 
-	def update_viewport_lines(self):
-		logging.error(self.lines)
-		lines = []
-		for i in range(len(self.lines)):
-			cur_lines = textwrap.wrap(self.lines[i], self.window_dimensions[1])
-			lines += cur_lines
+	def scroll_by(self, rows):
+		"""Move the scroll head by a number of rows, negative is up"""
+		self.current_scroll_head += rows
+		while self.current_scroll_head < 0 and self.lines.base:
+			self.page_in(config.SCROLLBACK_CHUNK)
+		while self.current_scroll_head + self.true_output_height > len(self.index) and not self.lines.attached:
+			self.page_in_after(config.SCROLLBACK_CHUNK)
+
+		self.current_scroll_head = max(0, min(self.current_scroll_head, len(self.index) - self.true_output_height))
+		self.trim_scrollback()
+		self.changed()
+
+	def on_page_up(self):
+		self.scroll_by(-max(1, self.true_output_height - 1))
+
+	def on_page_down(self):
+		self.scroll_by(max(1, self.true_output_height - 1))
+
+	def on_home(self):
+		self.scroll_to_line(0)
+
+	def on_end(self):
+		if not self.lines.attached:
+			self.load_window(self.lines.total - config.SCROLLBACK_CHUNK)
+		self.current_scroll_head = len(self.index) - self.true_output_height
+		self.trim_scrollback()
+		self.changed()
+
+	def replace_lines(self, replacements):
+		"""Swap out logical lines, given as {line number: new line}. Only those lines are rewrapped."""
+		anchor = self.get_anchor()
+		for line_no, line in replacements.items():
+			self.lines.replace(line_no, line)
+			# Lines that are only on disk get wrapped when they are paged in
+			if self.lines.in_memory(line_no):
+				self.index.update(line_no - self.lines.base, line)
+
+		self.set_anchor(anchor)
+		self.changed()
+
+	def scroll_to_line(self, line_no):
+		"""Scroll so a line, numbered like Scrollback numbers them, is at the top of the screen"""
+		if not self.lines.in_memory(line_no):
+			if self.lines.base - config.SCROLLBACK_CHUNK <= line_no < self.lines.base:
+				self.page_in(self.lines.base - line_no)
+			else:
+				# Too far to page in everything in between, so start over with a chunk around the line
+				self.load_window(line_no - config.SCROLLBACK_CHUNK // 2)
+
+		start = self.index.line_rows(line_no - self.lines.base)[0]
+		self.current_scroll_head = max(0, min(start, len(self.index) - self.true_output_height))
+		self.changed()
+
+	def get_visible_line(self):
+		"""The logical line at the top of the screen"""
+		if self.current_scroll_head <= 0:
+			return 0
+		return self.index.locate(self.current_scroll_head)[0]
+
+	def line_text(self, line):
+		"""The text of a logical line, without anything the page adds around it when wrapping"""
+		return line
+
+	def row_text(self, line, row):
+		"""The part of a row that comes from line_text()"""
+		return row
+
+	def row_offsets(self, idx):
+		"""Where each row of in-memory line idx starts in the clean text of the line"""
+		line = self.lines[idx]
+		content = text.strip_wrappers(self.line_text(line))
+		offsets = []
+		pos = 0
+		for row in self.index.rows_of(idx):
+			# Wrapping drops whitespace between rows, so look the row up rather than adding up lengths
+			clean = text.strip_wrappers(self.row_text(line, row)).strip()
+			found = content.find(clean, pos) if clean else -1
+			if found >= 0:
+				pos = found
+			offsets.append(pos)
+			pos += len(clean)
+		return offsets
+
+	def get_anchor(self):
+		"""The scroll position as (logical line, character offset into it), which survives rewrapping"""
+		if self.current_scroll_head <= 0 or not len(self.index):
+			return None
+
+		idx, row = self.index.locate(self.current_scroll_head)
+		return idx, self.row_offsets(idx)[row]
+
+	def set_anchor(self, anchor):
+		if anchor is None:
+			return
+
+		idx, chars = anchor
+		start, end = self.index.line_rows(idx)
+		# The last row that starts at or before the character
+		row = bisect.bisect_right(self.row_offsets(idx), chars) - 1
+		self.current_scroll_head = start + max(0, min(row, end - start - 1))
+
+	def reflow(self):
+		"""Rewrap a bounded chunk of lines after a resize, keeping the same text at the top of the screen"""
+		anchor = self.get_anchor()
+		self.index.reflow(self.lines, config.REFLOW_CHUNK)
+		self.set_anchor(anchor)
 
-		self.cur_viewport_lines = lines
+		if self.index.reflowing:
+			# Come back on the next frame to do the rest
+			self.changed()
 
-	# This does not work
 	def on_screen_update(self, window_dimensions, output_height):
 		self.output_height = output_height
-		if window_dimensions != self.window_dimensions:
-			# Do nothing to the text if the window has not been updated
-			old_window_dimensions = self.window_dimensions
-			char_idx_prev = self.current_scroll_head * old_window_dimensions[1]
-			if char_idx_prev:
-				char_idx_prev += 1
+		self.window_dimensions = window_dimensions
+		if self.text_width != self.index.width:
+			# Rewrap from the screen outwards, so the visible lines are done first
+			self.index.resize(self.text_width, self.get_visible_line())
 
-			self.window_dimensions = window_dimensions
-			self.current_scroll_head = math.ceil(char_idx_prev / self.window_dimensions[1])
-			if self.current_scroll_head: # Do nothing if 0
-				self.current_scroll_head -= 1
-
-			self.update_viewport_lines()
+		if self.index.reflowing:
+			self.reflow()
 
 class AutoScrolledPage(ScrollablePage):
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
 		self.update_scroll_head = True
 
+	def follow(self):
+		"""Move the scroll head to the bottom if autoscroll is on"""
+		if self.update_scroll_head:
+			self.current_scroll_head = len(self.index) - self.true_output_height
+
 	def on_scroll_down(self):
+		self.follow()
 		super().on_scroll_down()
-		if self.current_scroll_head == len(self.cur_viewport_lines) - self.true_output_height:
+		if self.lines.attached and self.current_scroll_head == len(self.index) - self.true_output_height:
 			self.update_scroll_head = True # Enable autoscroll
 
 	def on_scroll_up(self):
+		self.follow()
 		super().on_scroll_up()
 		self.update_scroll_head = False
 
-	def add_line(self, line):
-		super().add_line(line)
+	def scroll_by(self, rows):
+		self.follow()
+		super().scroll_by(rows)
+		# Back at the bottom turns autoscroll back on
+		self.update_scroll_head = self.lines.attached and self.current_scroll_head >= len(self.index) - self.true_output_height
+
+	def on_end(self):
+		self.update_scroll_head = True
+		super().on_end()
+
+	def scroll_to_line(self, line_no):
+		self.update_scroll_head = False
+		super().scroll_to_line(line_no)
+
+	def on_screen_update(self, window_dimensions, output_height):
+		super().on_screen_update(window_dimensions, output_height)
+		# The scroll head only moves once per frame, however many lines came in since the last one
+		self.follow()
+
+	def get_visible_line(self):
 		if self.update_scroll_head:
-			self.current_scroll_head = len(self.cur_viewport_lines) - self.true_output_height
+			# Stuck to the bottom, the last line is always on screen
+			return self.index.line_count - 1
+		return super().get_visible_line()
+
+	def reflow(self):
+		super().reflow()
+		self.follow()
 
 class OptionsPage(ScrollablePage):
 	'''
 	This pages offer options that can be navigated with goto
 	'''
-	def __init__(self, options = {}, *args, **kwargs):
+	def __init__(self, options = None, *args, **kwargs):
 		super().__init__(*args, **kwargs)
-		self.options = options
+		self.options = options if options is not None else {}
 
 	def add_option(self, option):
 		length = len(self.options.keys())
@@ -174,6 +459,69 @@ class OptionsPage(ScrollablePage):
 	def on_select(self, idx):
 		return self.options.get(idx, None)
 
+class ChannelListPage(OptionsPage):
+	"""The landing page. Lists the channels, with how many unread messages and whether there are mentions in each"""
+	def __init__(self, activity, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.activity = activity
+		# Channel ID -> (line number, option index, channel)
+		self.channel_lines = {}
+
+	def add_channel(self, channel):
+		idx = self.add_option(channel)
+		self.channel_lines[channel.id] = (self.lines.total, idx, channel)
+		self.add_line(self.channel_line(idx, channel))
+		return idx
+
+	def channel_line(self, idx, channel):
+		line = 8*" " + f'{idx}. #{channel.name}'
+		entry = self.activity.get(channel.id)
+		if entry is not None and entry.unread:
+			line += f'  <y>{entry.unread}<y>'
+			if entry.mentioned:
+				line += ' <r>@<r>'
+		return Text(line)
+
+	def on_screen_update(self, window_dimensions, output_height):
+		# Only the channels whose counts changed since the last frame get redrawn
+		if self.activity.changed:
+			replacements = {}
+			for channel_id in self.activity.changed:
+				if channel_id in self.channel_lines:
+					line_no, idx, channel = self.channel_lines[channel_id]
+					replacements[line_no] = self.channel_line(idx, channel)
+			self.activity.changed.clear()
+			if replacements:
+				self.replace_lines(replacements)
+
+		super().on_screen_update(window_dimensions, output_height)
+
+class SearchResultsPage(OptionsPage):
+	"""Messages found by :search. Selecting one opens its channel scrolled to it"""
+	def __init__(self, pageman, query, hits, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.pageman = pageman
+		self.add_line(f'**{len(hits)}** results for "{query}"')
+		for channel, record in hits:
+			idx = self.add_option((channel, record))
+			clockmsg = f'{utils.get_date(int(record.timestamp))} {utils.get_clock_time(int(record.timestamp))}'
+			self.add_line(8*" " + f'{idx}. #{channel.name} {clockmsg} {record.author}: {record.content}')
+
+	def on_select(self, idx):
+		option = self.options.get(idx, None)
+		if option is None:
+			return None
+
+		channel, record = option
+		channel_page = self.pageman.get_channel_page(channel.id)
+		line_no = channel_page.message_lines.get(record.id)
+		if line_no is not None:
+			channel_page.scroll_to_line(line_no)
+		else:
+			# Only in the local history, older than what the page holds: get as close as the page goes
+			channel_page.jump_to_time(record.timestamp)
+		return channel_page
+
 class RootPage(OptionsPage):
 	"""Application root page"""
 	def __init__(self):
@@ -181,51 +529,203 @@ class RootPage(OptionsPage):
 
 class ChannelChatPage(AutoScrolledPage):
 	def __init__(self, channel, bot, *args, **kwargs):
+		kwargs.setdefault("scrollback", config.SCROLLBACK_LINES)
 		super().__init__(*args, **kwargs)
 		self.channel = channel
 		self.bot = bot
 		self.opened = False
 
+		self.search_index = SearchIndex()
+		# Message ID -> line number, for edits and deletes
+		self.message_lines = {}
+		# Message timestamps in order, and the line number of each, for :jump
+		self.timestamps = array.array('d')
+		self.timestamp_lines = array.array('q')
+
+		self.loading_history = False
+		self.history_loaded = False
+		# Live events held back while the history loads, as ('message', message),
+		# ('edit', message ID, content) and ('delete', message IDs)
+		self._pending = []
+		self.last_message_id = 0
+
 	def on_first_open(self):
+		state = self.bot.state
+		if state.store is not None:
+			state.store.touch(self.channel.id)
+
+		# Does nothing if the history is already in, moves it to the front of the queue otherwise
+		state.prefetcher.request(self, prefetch.FOCUSED)
+
+	def open(self):
+		"""Start taking live messages. They are held back until the history has loaded."""
 		if self.opened:
 			return
 
-		asyncio.create_task(self.send_history(100))
+		self.loading_history = True
 		self.opened = True
 
-	async def process_message(self, message, show_time = False):
+	def process_message(self, message, show_time = False):
 		if not self.opened:
 			return
 
 		if (message.channel.id != self.channel.id):
 			return
 
-		curtime = int(message.created_at.timestamp())
-		clockmsg = f'{utils.get_clock_time(curtime)}'
-
-		# handle line breaks. In future, this should all be moved to state
-		line_content = message.content
-		author_name = f'{message.author.display_name}'
-		fmt_tags = []
-		if message.author.id != self.bot.user.id:
-			fmt_tags.append("**")
-			author_name = "**" + author_name + "**"
-
-		# output = with_prefix(line_content, clockmsg, message.author.display_name, 32, True, fmt_tags)
-		
-		wrapped_lines = textwrap.wrap(line_content, self.window_dimensions[1] - config.PREFIX_LEN - 8) 
-		for i in range(len(wrapped_lines)):
-			if (i == 0):
-				first = True
-			else:
-				first = False
-			wrapped_lines[i] = with_prefix(Text(wrapped_lines[i]), Text(clockmsg), Text(author_name), config.PREFIX_LEN, first, fmt_tags)
+		# Live messages that come in while history is loading are shown after it
+		if self.loading_history:
+			self._pending.append(('message', message))
+			return
 
-		for line in wrapped_lines:
-			self.add_line(line)
+		# Only stored once the page is in sync, so the only holes in the store are the recorded gaps
+		store = self.bot.state.store
+		if store is not None:
+			store.add(message)
 
-	async def send_history(self, limit):
-		history = list(reversed([message async for message in self.channel.history(limit = limit)]))
-		for message in history:
-			await self.process_message(message, show_time = True)
+		self.add_message(MessageRecord.from_message(message, self.bot.user.id))
 
+	def add_message(self, record):
+		self.last_message_id = record.id
+		self.message_lines[record.id] = self.lines.total
+		# Messages come in in order nearly always, so this is almost always an append
+		if not self.timestamps or record.timestamp >= self.timestamps[-1]:
+			self.timestamps.append(record.timestamp)
+			self.timestamp_lines.append(self.lines.total)
+		else:
+			idx = bisect.bisect_right(self.timestamps, record.timestamp)
+			self.timestamps.insert(idx, record.timestamp)
+			self.timestamp_lines.insert(idx, self.lines.total)
+		self.search_index.add(self.lines.total, record.content)
+		self.add_line(record)
+
+	def jump_to_time(self, timestamp):
+		"""Scroll to the first message sent at or after timestamp. Returns False if there is none."""
+		idx = bisect.bisect_left(self.timestamps, timestamp)
+		if idx == len(self.timestamps):
+			return False
+
+		self.scroll_to_line(self.timestamp_lines[idx])
+		return True
+
+	def edit_message(self, message_id, content):
+		# The message may still be on its way in, so wait until it is
+		if self.loading_history:
+			self._pending.append(('edit', message_id, content))
+			return
+
+		line_no = self.message_lines.get(message_id)
+		if line_no is None:
+			return
+
+		record = self.lines.get(line_no).edited(content)
+		self.search_index.add(line_no, content)
+		self.replace_lines({line_no: record})
+
+	def delete_messages(self, message_ids):
+		"""Remove messages from the page, all in one update"""
+		if self.loading_history:
+			self._pending.append(('delete', message_ids))
+			return
+
+		replacements = {}
+		for message_id in message_ids:
+			line_no = self.message_lines.pop(message_id, None)
+			if line_no is not None:
+				replacements[line_no] = self.lines.get(line_no).deleted()
+
+		if replacements:
+			self.replace_lines(replacements)
+
+	def wrap_line(self, line, width):
+		if isinstance(line, MessageRecord):
+			return line.render(width)
+		return super().wrap_line(line, width)
+
+	def line_text(self, line):
+		if isinstance(line, MessageRecord):
+			return line.content
+		return line
+
+	def row_text(self, line, row):
+		# Message rows start with the time and author prefix, which is always PREFIX_LEN cells wide
+		if isinstance(line, MessageRecord):
+			return text.split_at_width(text.strip_wrappers(row), config.PREFIX_LEN)[1]
+		return row
+
+	def encode_line(self, line):
+		if isinstance(line, MessageRecord):
+			return line.to_json()
+		return line
+
+	def decode_line(self, data):
+		# Messages are stored as lists, everything else as plain strings
+		if isinstance(data, list):
+			return MessageRecord.from_json(data)
+		return Text(data)
+
+	async def fetch_history(self, limit, after = None):
+		"""Fetch messages from the API, oldest first. With `after`, a message ID, only the ones sent after it."""
+		if after is None:
+			history = [message async for message in self.channel.history(limit = limit)]
+			history.reverse()
+			return history
+
+		# Only needed here, so the pages can be used without discord.py
+		import discord
+		# history() returns oldest first by itself when after is given
+		return [message async for message in self.channel.history(limit = limit, after = discord.Object(id = after))]
+
+	async def send_history(self, limit):
+		store = self.bot.state.store
+		try:
+			last = None
+			if store is not None:
+				# Show what we already have straight away
+				stored = store.recent(self.channel.id, limit)
+				gaps = store.gaps(self.channel.id, stored[0][0]) if stored else []
+				for message_id, author_id, author_name, timestamp, content in stored:
+					if gaps and message_id >= gaps[0]:
+						gaps.pop(0)
+						self.add_line(Text(SKIPPED_MARKER))
+					flags = OWN if author_id == self.bot.user.id else 0
+					self.add_message(MessageRecord(message_id, author_name, timestamp, content, flags))
+				last = store.last(self.channel.id)
+
+			if last is None:
+				history = await self.fetch_history(limit)
+			else:
+				# Only ask for what came after the newest stored message
+				history = await self.fetch_history(limit, after = last)
+				skipped = len(history) >= limit
+				if skipped:
+					# Too far behind to catch up, skip ahead to the newest messages instead. There are
+					# at least `limit` messages after the stored ones, so these are all new too.
+					self.add_line(Text(SKIPPED_MARKER))
+					history = await self.fetch_history(limit)
+				# The hole is kept in the store too, so later sessions show it instead of joining across it
+				if skipped and history:
+					store.add_gap(self.channel.id, history[0].id)
+
+			if store is not None:
+				store.add_many(history)
+
+			for message in history:
+				self.add_message(MessageRecord.from_message(message, self.bot.user.id))
+		finally:
+			self.loading_history = False
+			self.history_loaded = True
+			pending, self._pending = self._pending, []
+			for event in pending:
+				match event:
+					case ('message', message):
+						if message.id > self.last_message_id:
+							self.process_message(message)
+					# The fetched history may be older than these, in the store as well as on the page
+					case ('edit', message_id, content):
+						if store is not None:
+							store.edit(self.channel.id, message_id, content)
+						self.edit_message(message_id, content)
+					case ('delete', message_ids):
+						if store is not None:
+							store.delete(self.channel.id, message_ids)
+						self.delete_messages(message_ids)
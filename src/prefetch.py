@@ -0,0 +1,98 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+import config
+
+# Request priorities, lower is loaded first. Recently used channels get
+# RECENT + their rank, so the most recent one comes first.
+FOCUSED = 0
+PINNED = 1
+RECENT = 2
+
+class HistoryPrefetcher:
+	"""Loads channel history in the background, a few channels at a time.
+
+	Pages are queued with a priority and loaded in that order by at most
+	`concurrency` fetches at once. Requesting a queued page again with a better
+	priority moves it up, which is how the focused channel jumps the queue.
+	Fetches are started at least `min_interval` seconds apart so a burst of
+	them stays clear of the API rate limits.
+	"""
+	def __init__(self, concurrency = 3, min_interval = 0):
+		self.semaphore = asyncio.Semaphore(concurrency)
+		self.min_interval = min_interval
+
+		# Heap of (priority, sequence, page). Entries that a better request
+		# replaced are skipped when popped
+		self._queue = []
+		self._priority = {}
+		self._seq = itertools.count()
+		self._wakeup = asyncio.Event()
+		self._task = None
+		self._last_start = 0
+
+		# Page -> task of the fetches that are running
+		self.in_flight = {}
+		self.loaded = 0
+
+	def request(self, page, priority):
+		if page.history_loaded or page in self.in_flight:
+			return
+
+		if self._priority.get(page, priority + 1) <= priority:
+			return
+
+		# Live messages are held back by the page from here on, until its history is in
+		page.open()
+		self._priority[page] = priority
+		heapq.heappush(self._queue, (priority, next(self._seq), page))
+		self._wakeup.set()
+
+		if self._task is None:
+			self._task = asyncio.create_task(self.run())
+
+	def _pop(self):
+		while self._queue:
+			priority, _, page = heapq.heappop(self._queue)
+			if self._priority.get(page) == priority:
+				del self._priority[page]
+				return page
+		return None
+
+	async def run(self):
+		while True:
+			if not self._priority:
+				self._wakeup.clear()
+				await self._wakeup.wait()
+
+			await self.semaphore.acquire()
+			delay = self._last_start + self.min_interval - time.monotonic()
+			if delay > 0:
+				await asyncio.sleep(delay)
+
+			# Popped only now, so a page focused while we were waiting still goes first
+			page = self._pop()
+			if page is None:
+				self.semaphore.release()
+				continue
+
+			self._last_start = time.monotonic()
+			self.in_flight[page] = asyncio.create_task(self.load(page))
+
+	async def load(self, page):
+		try:
+			await page.send_history(config.HISTORY_LIMIT)
+		except Exception as e:
+			logging.error(e)
+		finally:
+			self.in_flight.pop(page, None)
+			self.loaded += 1
+			self.semaphore.release()
+
+	def cancel(self):
+		if self._task is not None:
+			self._task.cancel()
+			self._task = None
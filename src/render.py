@@ -0,0 +1,179 @@
+import curses
+import time
+
+import text
+import config
+
+from config import INPUT_HEIGHT, MODAL_HEIGHT, MODAL_BORDER_ENABLED, OUTPUT_BORDER_ENABLED
+
+class CursesBackend:
+	"""Draws to the terminal through curses"""
+	def new_window(self, height, width, y, x):
+		return curses.newwin(height, width, y, x)
+
+	def clear(self):
+		pass
+
+	@property
+	def style_attrs(self):
+		return text.get_style_attrs()
+
+	def flush(self):
+		curses.doupdate()
+
+class MemoryWindow:
+	"""A window that records what is drawn into it as a grid of (character, attribute) cells.
+
+	Implements the part of the curses window API the renderer uses. Writes past
+	the right edge are clipped and counted in `overflow` rather than raising.
+	"""
+	def __init__(self, height, width, y, x):
+		self.height = height
+		self.width = width
+		self.y = y
+		self.x = x
+		self.overflow = 0
+		self.erase()
+
+	def erase(self):
+		self.cells = [[(' ', 0)] * self.width for _ in range(self.height)]
+
+	def addstr(self, y, x, string, attr = 0):
+		if not 0 <= y < self.height:
+			raise curses.error(f"addstr() row {y} is outside the window")
+
+		row = self.cells[y]
+		for ch in string:
+			width = text.char_width(ch)
+			if x + width > self.width:
+				self.overflow += 1
+				return
+			row[x] = (ch, attr)
+			# The second cell of a wide character is left empty
+			if width == 2:
+				row[x + 1] = ('', attr)
+			x += width
+
+	def border(self):
+		for row in self.cells:
+			row[0] = row[-1] = ('│', 0)
+		self.cells[0] = [('┌', 0)] + [('─', 0)] * (self.width - 2) + [('┐', 0)]
+		self.cells[-1] = [('└', 0)] + [('─', 0)] * (self.width - 2) + [('┘', 0)]
+
+	def scrollok(self, flag):
+		pass
+
+	def noutrefresh(self):
+		pass
+
+	def row_text(self, y):
+		return ''.join(ch for ch, attr in self.cells[y])
+
+class MemoryBackend:
+	"""Renders into memory instead of a terminal. Used for benchmarks and for running without a tty."""
+	# Bit flags rather than curses attributes, since those need an initialized terminal
+	style_attrs = {
+		None: 0,
+		'bold': 1,
+		'dim': 2,
+		'reverse': 4,
+		'underline': 8,
+		'green': 16,
+		'red': 32,
+		'yellow': 64,
+	}
+
+	def __init__(self):
+		self.windows = []
+		self.frames = 0
+
+	def new_window(self, height, width, y, x):
+		window = MemoryWindow(height, width, y, x)
+		self.windows.append(window)
+		return window
+
+	def clear(self):
+		self.windows.clear()
+
+	def flush(self):
+		self.frames += 1
+
+	def screen(self):
+		"""What the screen currently shows, as a list of strings"""
+		height = max((w.y + w.height for w in self.windows), default = 0)
+		width = max((w.x + w.width for w in self.windows), default = 0)
+		grid = [[' '] * width for _ in range(height)]
+		for window in self.windows:
+			for y, row in enumerate(window.cells):
+				grid[window.y + y][window.x:window.x + window.width] = [ch for ch, attr in row]
+		return [''.join(row) for row in grid]
+
+class Renderer:
+	"""Lays out the modal, output and input windows on a backend and draws frames into them"""
+	def __init__(self, backend):
+		self.backend = backend
+		self.windows = None
+		self.dimensions = (0, 0)
+		self.output_height = 0
+
+	def resize(self, height, width):
+		"""Recreate the windows for a new terminal size"""
+		self.dimensions = (height, width)
+		self.output_height = height - INPUT_HEIGHT - MODAL_HEIGHT
+
+		# Gotta do some monkey business here
+		config.WINDOW_MAX_X = width
+		config.WINDOW_MAX_Y = height
+		config.OUTPUT_HEIGHT = self.output_height
+
+		self.backend.clear()
+		modal_win = self.backend.new_window(MODAL_HEIGHT, width, 0, 0)
+		output_win = self.backend.new_window(self.output_height, width, MODAL_HEIGHT, 0)
+		input_win = self.backend.new_window(INPUT_HEIGHT, width, height - INPUT_HEIGHT, 0)
+		input_win.scrollok(True)
+		self.windows = (modal_win, output_win, input_win)
+
+	def draw(self, state):
+		start = time.perf_counter()
+
+		# Layout: reflow, scrolling and picking the visible rows
+		state.on_screen_update(self.dimensions, self.output_height)
+		rows = state.viewport(self.output_height - 2*int(OUTPUT_BORDER_ENABLED))
+		layout_done = time.perf_counter()
+
+		modal_win, output_win, input_win = self.windows
+		width = self.dimensions[1]
+		attrs = self.backend.style_attrs
+
+		# Modal window
+		modal_win.erase()
+
+		modal_lines = state.modal.lines
+		if len(modal_lines) > MODAL_HEIGHT - 2*int(MODAL_BORDER_ENABLED):
+			modal_lines = [f"Cannot render modal : Too many lines ({len(modal_lines)})"]
+
+		for idx, line in enumerate(modal_lines):
+			text.render_text_line(modal_win, idx + int(MODAL_BORDER_ENABLED), 1, line.get_renderable(width - 2), attrs = attrs)
+
+		modal_win.border()
+		modal_win.noutrefresh()
+
+		# Output window
+		output_win.erase()
+
+		for idx, line in enumerate(rows):
+			text.render_text_line(output_win, idx + int(OUTPUT_BORDER_ENABLED), 1, line, attrs = attrs)
+
+		output_win.border()
+		output_win.noutrefresh()
+
+		# Input window. Refreshed last so the cursor ends up here
+		input_win.erase()
+
+		input_win.border()
+		input_win.addstr(1, 1, state.input[-(width - 2):])
+		input_win.noutrefresh()
+
+		self.backend.flush()
+
+		state.metrics.record_frame(layout_done - start, time.perf_counter() - layout_done)
@@ -0,0 +1,153 @@
+import asyncio
+import datetime
+import gzip
+import json
+import time
+
+import discord
+
+from types import SimpleNamespace
+
+import client
+
+class Recorder:
+	"""Writes the gateway events of a session to a gzipped JSON lines file.
+
+	Every event is a single array: [seconds since the start, kind, fields...].
+	Only the fields the handlers use are kept, so a long session stays small.
+	"""
+	def __init__(self, path):
+		self.path = path
+		self._file = gzip.open(path, 'wt')
+		self._start = time.monotonic()
+		self.events = 0
+
+	def write(self, kind, *fields):
+		self._file.write(json.dumps([round(time.monotonic() - self._start, 3), kind, *fields], separators = (',', ':')) + '\n')
+		self.events += 1
+
+	def ready(self, user_id, guilds):
+		self.write('ready', user_id, [
+			[guild.id, guild.name, [[channel.id, channel.name] for channel in guild.channels if hasattr(channel, 'history')]]
+			for guild in guilds
+		])
+
+	def message(self, message):
+		self.write(
+			'message', message.id, message.channel.id, message.author.id, message.author.display_name,
+			message.created_at.timestamp(), message.content,
+			[user.id for user in message.mentions], message.mention_everyone
+		)
+
+	def edit(self, channel_id, message_id, content):
+		self.write('edit', channel_id, message_id, content)
+
+	def delete(self, channel_id, message_ids):
+		self.write('delete', channel_id, list(message_ids))
+
+	def presence(self, before, after):
+		self.write('presence', after.id, after.display_name, after.guild.id, str(before.status), str(after.status))
+
+	def close(self):
+		self._file.close()
+
+class ReplayChannel:
+	"""Stands in for a discord channel. There is no history to fetch, everything comes from the recording."""
+	def __init__(self, id, name, guild):
+		self.id = id
+		self.name = name
+		self.guild = guild
+
+	async def history(self, *args, **kwargs):
+		return
+		yield
+
+	async def send(self, content):
+		pass
+
+class ReplayClient:
+	"""Stands in for Vuut while replaying. The event handlers are Vuut's own, so replayed
+	events go through exactly the code that live ones do."""
+	on_ready = client.Vuut.on_ready
+	on_message = client.Vuut.on_message
+	on_raw_message_edit = client.Vuut.on_raw_message_edit
+	on_raw_message_delete = client.Vuut.on_raw_message_delete
+	on_raw_bulk_message_delete = client.Vuut.on_raw_bulk_message_delete
+	on_presence_update = client.Vuut.on_presence_update
+	make_channel_page = client.Vuut.make_channel_page
+
+	def __init__(self, state):
+		self.state = state
+		self.user = None
+		self.guilds = []
+		self.channels = {}
+
+	def load_ready(self, user_id, guilds):
+		self.user = SimpleNamespace(id = user_id)
+		for guild_id, guild_name, channels in guilds:
+			guild = SimpleNamespace(id = guild_id, name = guild_name, channels = [])
+			for channel_id, channel_name in channels:
+				channel = ReplayChannel(channel_id, channel_name, guild)
+				guild.channels.append(channel)
+				self.channels[channel_id] = channel
+			self.guilds.append(guild)
+
+	def make_message(self, message_id, channel_id, author_id, author_name, created_at, content, mentions, mention_everyone):
+		return SimpleNamespace(
+			id = message_id,
+			channel = self.channels.get(channel_id) or SimpleNamespace(id = channel_id),
+			author = SimpleNamespace(id = author_id, display_name = author_name),
+			created_at = datetime.datetime.fromtimestamp(created_at, datetime.timezone.utc),
+			content = content,
+			mentions = [SimpleNamespace(id = user_id) for user_id in mentions],
+			mention_everyone = mention_everyone,
+		)
+
+	def make_members(self, user_id, display_name, guild_id, before, after):
+		guild = next((guild for guild in self.guilds if guild.id == guild_id), None)
+		return (
+			SimpleNamespace(id = user_id, display_name = display_name, guild = guild, status = discord.Status(before)),
+			SimpleNamespace(id = user_id, display_name = display_name, guild = guild, status = discord.Status(after)),
+		)
+
+	async def dispatch(self, kind, fields):
+		match kind:
+			case 'ready':
+				self.load_ready(*fields)
+				await self.on_ready()
+			case 'message':
+				await self.on_message(self.make_message(*fields))
+			case 'edit':
+				channel_id, message_id, content = fields
+				await self.on_raw_message_edit(SimpleNamespace(channel_id = channel_id, message_id = message_id, data = {'content': content}))
+			case 'delete':
+				channel_id, message_ids = fields
+				if len(message_ids) == 1:
+					await self.on_raw_message_delete(SimpleNamespace(channel_id = channel_id, message_id = message_ids[0]))
+				else:
+					await self.on_raw_bulk_message_delete(SimpleNamespace(channel_id = channel_id, message_ids = set(message_ids)))
+			case 'presence':
+				await self.on_presence_update(*self.make_members(*fields))
+
+	async def replay(self, path, speed = 1):
+		"""Feed a recording to the handlers, `speed` times faster than it happened. 0 goes as fast as possible."""
+		loop = asyncio.get_running_loop()
+		start = loop.time()
+		events = 0
+		with gzip.open(path, 'rt') as f:
+			for line in f:
+				offset, kind, *fields = json.loads(line)
+				if speed:
+					delay = start + offset / speed - loop.time()
+					if delay > 0:
+						await asyncio.sleep(delay)
+				elif events % 100 == 0:
+					# Still give the UI a turn every so often
+					await asyncio.sleep(0)
+
+				await self.dispatch(kind, fields)
+				events += 1
+
+		elapsed = loop.time() - start
+		self.state.modal.set(2, 0, f"Replayed {events} events in {elapsed:.1f}s", timeout = 10)
+		return events
@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+class RedrawScheduler:
+	"""Decides when the UI loop should draw a frame.
+
+	Anything that changes what is on screen calls mark_dirty(). The UI loop
+	only draws when consume() says so, instead of redrawing on every iteration.
+	Frames are capped at max_fps, and everything that happens in between two
+	frames ends up in the same frame.
+	"""
+	def __init__(self, max_fps = None):
+		self.dirty = True
+		self._wakeup = asyncio.Event()
+
+		self.min_frame_interval = 1 / max_fps if max_fps else 0
+		self.last_frame = 0
+		self.frames = 0
+		# Number of times a frame had to wait because of the cap
+		self.throttled = 0
+
+	def mark_dirty(self, *args):
+		# Accepts (and ignores) arguments so it can be used directly as a callback
+		self.dirty = True
+		self._wakeup.set()
+
+	def consume(self):
+		if not self.dirty:
+			return False
+
+		self.dirty = False
+		self._wakeup.clear()
+		self.last_frame = time.monotonic()
+		self.frames += 1
+		return True
+
+	async def wait(self, timeout = None):
+		"""Sleep until something is marked dirty, or until timeout runs out"""
+		if not self.dirty:
+			try:
+				await asyncio.wait_for(self._wakeup.wait(), timeout)
+			except asyncio.TimeoutError:
+				pass
+
+		delay = self.last_frame + self.min_frame_interval - time.monotonic()
+		if self.dirty and delay > 0:
+			self.throttled += 1
+			await asyncio.sleep(delay)
@@ -0,0 +1,211 @@
+import collections
+import itertools
+import tempfile
+import json
+import array
+import sys
+
+import config
+
+class SpillFile:
+	"""Append-only on-disk segment for lines that were evicted from memory.
+
+	Only the byte offset of every record is kept in memory. The file is a
+	temporary file, so it goes away with the process. Lines are stored as JSON,
+	after going through `encode`, and come back through `decode`.
+	"""
+	def __init__(self, directory = None, encode = None, decode = None):
+		self.directory = directory
+		self.encode = encode
+		self.decode = decode
+		self._file = None
+		self._offsets = array.array('q')
+
+	def __len__(self):
+		return len(self._offsets)
+
+	def append(self, line):
+		if self._file is None:
+			self._file = tempfile.TemporaryFile(dir = self.directory)
+
+		self._file.seek(0, 2)
+		self._offsets.append(self._file.tell())
+		if self.encode is not None:
+			line = self.encode(line)
+		self._file.write(json.dumps(line).encode() + b'\n')
+
+	def read(self, start, stop):
+		if start >= stop:
+			return []
+
+		self._file.flush()
+		self._file.seek(self._offsets[start])
+		lines = [json.loads(self._file.readline()) for _ in range(stop - start)]
+		if self.decode is not None:
+			lines = [self.decode(line) for line in lines]
+		return lines
+
+	def close(self):
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+
+class Scrollback:
+	"""The logical lines of a page, with at most roughly `capacity` of them in memory.
+
+	Lines are numbered from the oldest one ever added. Memory holds a window of
+	them starting at `base`; everything before it lives in the spill file and can
+	be paged back in with page_in(). The window normally runs to the newest line.
+	load() can move it anywhere and drop_back() can cut its end off, both after
+	writing everything out to the spill file. Until the window is back at the end
+	new lines go straight to disk, and page_in_after() brings them back.
+	A capacity of None keeps everything in memory.
+	"""
+	def __init__(self, capacity = None, lines = (), encode = None, decode = None):
+		self.capacity = capacity
+		self.base = 0
+		self._lines = collections.deque(lines)
+		# Rough size in bytes of the lines in memory, for the :perf overlay. Kept up to date as lines come and go.
+		self.line_bytes = sum(map(sys.getsizeof, self._lines))
+		# Number of lines after the window, all of them on disk
+		self._after = 0
+		self._spill = SpillFile(config.SCROLLBACK_SPILL_DIR, encode, decode)
+		# Replacements for lines whose copy on disk is out of date
+		self._replaced = {}
+
+	def __len__(self):
+		return len(self._lines)
+
+	def __iter__(self):
+		return iter(self._lines)
+
+	def __getitem__(self, idx):
+		return self._lines[idx]
+
+	@property
+	def end(self):
+		"""Number of the first line after the window"""
+		return self.base + len(self._lines)
+
+	@property
+	def total(self):
+		"""Number of lines including the ones on disk"""
+		return self.end + self._after
+
+	@property
+	def attached(self):
+		"""Whether the window runs to the newest line"""
+		return not self._after
+
+	@property
+	def excess(self):
+		if self.capacity is None:
+			return 0
+		return max(0, len(self._lines) - self.capacity)
+
+	def in_memory(self, line_no):
+		return self.base <= line_no < self.end
+
+	def _read_spill(self, start, stop):
+		lines = self._spill.read(start, stop)
+		if self._replaced:
+			lines = [self._replaced.get(start + idx, line) for idx, line in enumerate(lines)]
+		return lines
+
+	def get(self, line_no):
+		"""A line by its number, read back from disk if it isn't in memory"""
+		if self.in_memory(line_no):
+			return self._lines[line_no - self.base]
+		if line_no in self._replaced:
+			return self._replaced[line_no]
+		return self._spill.read(line_no, line_no + 1)[0]
+
+	def read(self, start, stop):
+		"""Lines [start, stop) by number, from disk and from memory"""
+		lines = []
+		if start < self.base:
+			lines = self._read_spill(start, min(stop, self.base))
+
+		if stop > self.base and start < self.end:
+			lines.extend(itertools.islice(self._lines, max(0, start - self.base), min(stop, self.end) - self.base))
+
+		if stop > self.end:
+			lines.extend(self._read_spill(max(start, self.end), stop))
+		return lines
+
+	def replace(self, line_no, line):
+		"""Swap out a line by its number, whether it is in memory or on disk"""
+		if self.in_memory(line_no):
+			self.line_bytes += sys.getsizeof(line) - sys.getsizeof(self._lines[line_no - self.base])
+			self._lines[line_no - self.base] = line
+		# The spill file is append only, so lines that are on disk get their new version from here
+		if line_no < len(self._spill):
+			self._replaced[line_no] = line
+
+	def append(self, line):
+		if self._after:
+			self._spill.append(line)
+			self._after += 1
+		else:
+			self._lines.append(line)
+			self.line_bytes += sys.getsizeof(line)
+
+	def evict(self, n):
+		"""Drop the oldest n lines from memory, writing them to disk if they aren't there yet"""
+		for _ in range(min(n, len(self._lines))):
+			line = self._lines.popleft()
+			self.line_bytes -= sys.getsizeof(line)
+			# Lines that were paged back in are already on disk
+			if self.base == len(self._spill):
+				self._spill.append(line)
+			self.base += 1
+
+	def flush(self):
+		"""Write out every line in memory that isn't on disk yet"""
+		for line in itertools.islice(self._lines, len(self._spill) - self.base, None):
+			self._spill.append(line)
+
+	def drop_back(self, n):
+		"""Drop the newest n lines from memory, writing them out first. Returns how many went."""
+		n = min(n, len(self._lines))
+		if n <= 0:
+			return 0
+
+		# The spill file is append only, so everything before them has to go out with them
+		self.flush()
+		for _ in range(n):
+			self.line_bytes -= sys.getsizeof(self._lines.pop())
+		self._after += n
+		return n
+
+	def page_in(self, n):
+		"""Load up to n lines before the in-memory window back from disk. Returns them oldest first."""
+		start = max(0, self.base - n)
+		lines = self.read(start, self.base)
+		self._lines.extendleft(reversed(lines))
+		self.line_bytes += sum(map(sys.getsizeof, lines))
+		self.base = start
+		return lines
+
+	def page_in_after(self, n):
+		"""Load up to n lines after the in-memory window back from disk. Returns them oldest first."""
+		lines = self.read(self.end, min(self.total, self.end + n))
+		self._lines.extend(lines)
+		self.line_bytes += sum(map(sys.getsizeof, lines))
+		self._after -= len(lines)
+		return lines
+
+	def load(self, start, stop):
+		"""Swap the in-memory window for lines [start, stop), without reading what lies in between"""
+		# Whatever isn't on disk yet has to be written out before it leaves memory
+		self.flush()
+
+		total = self.total
+		lines = self.read(start, stop)
+		self._lines = collections.deque(lines)
+		self.line_bytes = sum(map(sys.getsizeof, lines))
+		self.base = start
+		self._after = total - self.end
+
+	def close(self):
+		self._spill.close()
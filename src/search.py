@@ -0,0 +1,54 @@
+import array
+import bisect
+import re
+
+_WORD = re.compile(r'\w+')
+
+def words(content):
+	"""The lowercased words of a message, which is what gets indexed and searched for"""
+	return _WORD.findall(content.lower())
+
+def _contains(postings, value):
+	idx = bisect.bisect_left(postings, value)
+	return idx < len(postings) and postings[idx] == value
+
+class SearchIndex:
+	"""Inverted index from words to the lines of a page they appear in.
+
+	Lines are numbered like Scrollback numbers them, from the oldest line ever
+	added, so hits stay valid when lines are spilled to disk and paged back in.
+	Posting lists are kept sorted. New lines only ever append to them; an
+	edited line is inserted in place. Words that an edit removed are not taken
+	out, so hits should be checked against the line.
+	"""
+	def __init__(self):
+		self._postings = {}
+
+	def __len__(self):
+		return len(self._postings)
+
+	def add(self, line_no, content):
+		for word in set(words(content)):
+			postings = self._postings.get(word)
+			if postings is None:
+				postings = self._postings[word] = array.array('q')
+
+			if not postings or postings[-1] < line_no:
+				postings.append(line_no)
+			elif not _contains(postings, line_no):
+				postings.insert(bisect.bisect_left(postings, line_no), line_no)
+
+	def search(self, query):
+		"""Line numbers of the lines that contain every word of the query, newest first.
+		Hits are found as they are asked for, so the caller can check each one and
+		stop once it has enough good ones."""
+		terms = set(words(query))
+		if not terms:
+			return
+
+		lists = sorted((self._postings.get(term, ()) for term in terms), key = len)
+		# Walk the shortest list and look the rest up by binary search
+		shortest, rest = lists[0], lists[1:]
+		for line_no in reversed(shortest):
+			if all(_contains(postings, line_no) for postings in rest):
+				yield line_no
@@ -10,8 +10,15 @@ import utils
 import text
 import page
 import config
+import prefetch
+import notify
 
 from modal import ModalLine, Modal
+from scheduler import RedrawScheduler
+from metrics import Metrics
+from store import MessageStore
+from ingest import IngestQueue
+from activity import ActivityTable
 
 logging.basicConfig(filename='debug.log', level=logging.ERROR)
 
@@ -21,11 +28,26 @@ class State:
 		self.process_commands = False
 
 		self.on_first_screen_update_called = False
-		self.modal = Modal(3)
+		self.scheduler = RedrawScheduler(config.MAX_FPS)
+		self.metrics = Metrics()
+		# A replayed session shouldn't end up in the real history
+		self.store = MessageStore(config.MESSAGE_STORE_PATH) if config.MESSAGE_STORE_PATH and not config.REPLAY_PATH else None
+		self.prefetcher = prefetch.HistoryPrefetcher(config.HISTORY_PREFETCH_CONCURRENCY, config.HISTORY_PREFETCH_INTERVAL)
+		# Nor should it pop up real notifications
+		self.notifier = notify.Notifier(
+			notify.NullBackend() if config.REPLAY_PATH else notify.get_backend(config.NOTIFY_BACKEND),
+			config.NOTIFY_USER_INTERVAL, config.NOTIFY_COALESCE_WINDOW, config.NOTIFY_BURST
+		)
+		self.activity = ActivityTable()
+		# Gateway events are written here during a live session, to be replayed later
+		self.recorder = None
+		self.ingest_queue = IngestQueue(config.INGEST_QUEUE_SIZE, config.INGEST_PUT_TIMEOUT, on_put = self.scheduler.mark_dirty)
+		self.modal = Modal(3, on_change = self.scheduler.mark_dirty)
 		self.modal.set(0, 1 , "<g>Vuut2.0<g> <r>Alpha<r> <y>Tests<y>")
 
 		self.window_dimensions = (1,1)
 		self.output_height = 0
+		self._clock_time = None
 	
 		self.pageman = page.PageManager(self)
 
@@ -57,27 +79,97 @@ class State:
 			
 		self.input = ''
 
+	def prefetch_history(self):
+		"""Queue history loads for the pinned channels and the ones opened most recently"""
+		for channel_id in config.PINNED_CHANNELS:
+			channel_page = self.pageman.get_channel_page(channel_id)
+			if channel_page is not None:
+				self.prefetcher.request(channel_page, prefetch.PINNED)
+
+		if self.store is None:
+			return
+
+		for rank, channel_id in enumerate(self.store.recent_channels(config.HISTORY_PREFETCH_CHANNELS)):
+			channel_page = self.pageman.get_channel_page(channel_id)
+			if channel_page is not None:
+				self.prefetcher.request(channel_page, prefetch.RECENT + rank)
+
 	def output(self):
 		if self.pageman.focus:
 			return self.pageman.focus.get_renderable()
 		return ''
 
+	def viewport(self, height):
+		if self.pageman.focus:
+			return self.pageman.focus.get_viewport(height)
+		return []
+
 	def on_first_screen_update(self, window_dimensions, output_height):
-		if not config.START_BOT:
+		if not config.START_BOT and not config.REPLAY_PATH:
+			# Nothing will connect, so put something on screen to look at
 			import random
 			import string
+			filler = page.AutoScrolledPage(window_dimensions = window_dimensions)
 			for i in range(100):
-				# logging.error("hi")
 				size = random.randint(100, 500)
-				#logging.error(size)
-				self.current_channel_page.add_line(str(i) + '.'+ ''.join([random.choice(string.ascii_lowercase) for j in range(size)]))
+				filler.add_line(str(i) + '.'+ ''.join([random.choice(string.ascii_lowercase) for j in range(size)]))
+			self.pageman.set_focus(filler)
+
+
+	def tick(self):
+		"""Called on every iteration of the UI loop, whether or not a frame gets drawn"""
+		curtime = int(time.time())
+		if curtime != self._clock_time:
+			self._clock_time = curtime
+			self.modal.set(0, 2, utils.get_clock_time(curtime))
+			self.modal.set(2, 2, self.activity.summary())
+			if self.metrics.enabled:
+				self.update_perf_overlay()
+			# Store writes are committed in one go once a second
+			if self.store is not None:
+				self.store.commit()
 
+		self.modal.on_screen_update()
+		self.ingest()
+
+	def ingest(self):
+		"""Apply a batch of the gateway events that came in since the last frame"""
+		for event in self.ingest_queue.drain(config.INGEST_BATCH):
+			# A bad event only loses itself, not the rest of the batch or the UI loop
+			try:
+				self.pageman.apply(event)
+			except Exception as e:
+				logging.error(e)
+
+		# Whatever is left goes in the next frame
+		if len(self.ingest_queue):
+			self.scheduler.mark_dirty()
+
+	def update_perf_overlay(self):
+		self.metrics.update_rate()
+		overlay = self.metrics.overlay(self.pageman.focus, self.scheduler, self.ingest_queue)
+		for idx, element in enumerate(overlay):
+			self.modal.set(1, idx, element)
+
+	def toggle_perf_overlay(self):
+		if self.metrics.toggle():
+			self.update_perf_overlay()
+		else:
+			for idx in range(3):
+				self.modal.set(1, idx, '')
+
+	def next_wakeup(self):
+		"""Seconds until tick() has something to do: the clock ticking over or a modal timeout"""
+		curtime = time.time()
+		wakeup = 1 - curtime % 1
+		expiry = self.modal.next_expiry
+		if expiry is not None:
+			wakeup = min(wakeup, max(0, expiry - curtime))
+		return wakeup
 
 	def on_screen_update(self, window_dimensions, output_height):
 		self.window_dimensions = window_dimensions
 		self.output_height = output_height
-		self.modal.set(0, 2, utils.get_clock_time(int(time.time())))
-		self.modal.on_screen_update()
 		if self.pageman.focus:
 			self.pageman.focus.on_screen_update(window_dimensions, output_height)
 
@@ -0,0 +1,165 @@
+import sqlite3
+import time
+
+class MessageStore:
+	"""Local copy of channel history, keyed by channel and message ID.
+
+	Pages render what is stored straight away and only ask the API for messages
+	newer than the last stored one. Writes are batched: nothing is committed
+	until commit() is called.
+	"""
+	def __init__(self, path):
+		self.path = path
+		self.db = sqlite3.connect(path)
+		self.db.execute("PRAGMA journal_mode = WAL")
+		self.db.execute("PRAGMA synchronous = NORMAL")
+		self.db.execute("""
+			CREATE TABLE IF NOT EXISTS messages (
+				channel_id INTEGER NOT NULL,
+				message_id INTEGER NOT NULL,
+				author_id INTEGER NOT NULL,
+				author_name TEXT NOT NULL,
+				created_at REAL NOT NULL,
+				content TEXT NOT NULL,
+				PRIMARY KEY (channel_id, message_id)
+			) WITHOUT ROWID
+		""")
+		self.db.execute("""
+			CREATE TABLE IF NOT EXISTS channels (
+				channel_id INTEGER PRIMARY KEY,
+				last_opened REAL NOT NULL
+			)
+		""")
+		# Places where stored history is not continuous: messages were skipped right before message_id
+		self.db.execute("""
+			CREATE TABLE IF NOT EXISTS gaps (
+				channel_id INTEGER NOT NULL,
+				message_id INTEGER NOT NULL,
+				PRIMARY KEY (channel_id, message_id)
+			) WITHOUT ROWID
+		""")
+		self.create_search_index()
+		self.db.commit()
+		self.pending = 0
+
+	def create_search_index(self):
+		"""Full text index of the stored messages, kept up to date by triggers. The rowid is the message ID."""
+		exists = self.db.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone()
+		self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, channel_id UNINDEXED)")
+		# INSERT OR REPLACE on messages doesn't fire the delete trigger, so the insert replaces too
+		self.db.executescript("""
+			CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+				INSERT OR REPLACE INTO messages_fts (rowid, content, channel_id) VALUES (new.message_id, new.content, new.channel_id);
+			END;
+			CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+				UPDATE messages_fts SET content = new.content WHERE rowid = new.message_id;
+			END;
+			CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+				DELETE FROM messages_fts WHERE rowid = old.message_id;
+			END;
+		""")
+		# Stores from before the index existed get everything they already hold indexed once
+		if exists is None:
+			self.db.execute("INSERT INTO messages_fts (rowid, content, channel_id) SELECT message_id, content, channel_id FROM messages")
+
+	@staticmethod
+	def _row(message):
+		return (
+			message.channel.id,
+			message.id,
+			message.author.id,
+			message.author.display_name,
+			message.created_at.timestamp(),
+			message.content,
+		)
+
+	def add(self, message):
+		self.add_many([message])
+
+	def add_many(self, messages):
+		rows = [self._row(message) for message in messages]
+		self.db.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?)", rows)
+		self.pending += len(rows)
+
+	def edit(self, channel_id, message_id, content):
+		self.db.execute(
+			"UPDATE messages SET content = ? WHERE channel_id = ? AND message_id = ?",
+			(content, channel_id, message_id)
+		)
+		self.pending += 1
+
+	def delete(self, channel_id, message_ids):
+		self.db.executemany(
+			"DELETE FROM messages WHERE channel_id = ? AND message_id = ?",
+			[(channel_id, message_id) for message_id in message_ids]
+		)
+		self.pending += len(message_ids)
+
+	def commit(self):
+		if self.pending:
+			self.db.commit()
+			self.pending = 0
+
+	def last(self, channel_id):
+		"""ID of the newest stored message in a channel, or None"""
+		row = self.db.execute(
+			"SELECT message_id FROM messages WHERE channel_id = ? ORDER BY message_id DESC LIMIT 1",
+			(channel_id,)
+		).fetchone()
+		return row[0] if row else None
+
+	def recent(self, channel_id, limit):
+		"""The newest `limit` messages of a channel, oldest first, as
+		(message ID, author ID, author name, created_at timestamp, content) tuples"""
+		rows = self.db.execute(
+			"SELECT message_id, author_id, author_name, created_at, content FROM messages "
+			"WHERE channel_id = ? ORDER BY message_id DESC LIMIT ?",
+			(channel_id, limit)
+		).fetchall()
+		rows.reverse()
+		return rows
+
+	def search(self, terms):
+		"""Stored messages that contain every one of the words, newest first, as
+		(channel ID, message ID, author ID, author name, created_at timestamp, content) tuples.
+		Rows are read as they are asked for, so stop whenever there are enough."""
+		if not terms:
+			return
+		query = ' '.join(f'"{term}"' for term in terms)
+		yield from self.db.execute(
+			"SELECT m.channel_id, m.message_id, m.author_id, m.author_name, m.created_at, m.content "
+			"FROM messages_fts JOIN messages m ON m.channel_id = messages_fts.channel_id AND m.message_id = messages_fts.rowid "
+			"WHERE messages_fts MATCH ? ORDER BY messages_fts.rowid DESC",
+			(query,)
+		)
+
+	def add_gap(self, channel_id, message_id):
+		"""Remember that messages were skipped right before message_id"""
+		self.db.execute("INSERT OR REPLACE INTO gaps VALUES (?, ?)", (channel_id, message_id))
+		self.pending += 1
+
+	def gaps(self, channel_id, after):
+		"""IDs of the messages that come right after a gap, from `after` on, in order"""
+		rows = self.db.execute(
+			"SELECT message_id FROM gaps WHERE channel_id = ? AND message_id >= ? ORDER BY message_id",
+			(channel_id, after)
+		)
+		return [message_id for message_id, in rows]
+
+	def touch(self, channel_id):
+		"""Remember that a channel was just opened"""
+		self.db.execute("INSERT OR REPLACE INTO channels VALUES (?, ?)", (channel_id, time.time()))
+		self.pending += 1
+
+	def recent_channels(self, limit):
+		"""IDs of the `limit` most recently opened channels, most recent first"""
+		rows = self.db.execute("SELECT channel_id FROM channels ORDER BY last_opened DESC LIMIT ?", (limit,))
+		return [channel_id for channel_id, in rows]
+
+	def close(self):
+		if self.db is None:
+			return
+
+		self.commit()
+		self.db.close()
+		self.db = None
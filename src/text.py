@@ -1,6 +1,8 @@
 import re
 import curses
 import logging
+import functools
+import unicodedata
 
 from colors import *
 
@@ -15,7 +17,7 @@ def with_prefix(line_content, created_at, author_name, len_max, is_first_line, f
 	# Note, len_max includes the " | "
 	prefix = lr_justified(Text(created_at), Text(author_name), len_max - 3)
 	if not is_first_line:
-		prefix = " "*len(prefix.clean)
+		prefix = " "*prefix.size
 
 	prefix += " | "
 
@@ -26,60 +28,238 @@ def with_prefix(line_content, created_at, author_name, len_max, is_first_line, f
 	# logging.error(res)
 	return res
 
-def get_formatting_patterns():
-	formatting_patterns = [
-		(r'\*\*(.+?)\*\*', curses.A_BOLD),
-		(r'\*(.+?)\*', curses.A_DIM),
-		(r'`(.+?)`', curses.A_REVERSE),
-		(r'_(.+?)_', curses.A_UNDERLINE),
-		(r'<g>(.+?)<g>', curses.color_pair(GREEN)),
-		(r'<r>(.+?)<r>', curses.color_pair(RED)),
-		(r'<y>(.+?)<y>', curses.color_pair(YELLOW))
-	]
-	return formatting_patterns
+# (opening tag, closing tag, style). Order matters: when two tags match at the
+# same position the earlier one wins, so ** has to come before *
+FORMATTING = (
+	('**', '**', 'bold'),
+	('*', '*', 'dim'),
+	('`', '`', 'reverse'),
+	('_', '_', 'underline'),
+	('<g>', '<g>', 'green'),
+	('<r>', '<r>', 'red'),
+	('<y>', '<y>', 'yellow'),
+)
+
+# Every tag pair as one alternative of a single regex, so a line is tokenized in one scan.
+# The named group that matched tells us the style.
+_TOKENIZER = re.compile('|'.join(
+	f'{re.escape(opening)}(?P<{style}>.+?){re.escape(closing)}'
+	for opening, closing, style in FORMATTING
+))
+
+_TAGS = {style: (opening, closing) for opening, closing, style in FORMATTING}
+
+TOKEN_CACHE_SIZE = 4096
+WIDTH_CACHE_SIZE = 4096
+
+_style_attrs = None
+
+def get_style_attrs():
+	"""Curses attributes for each style. Built lazily, since color pairs need curses to be initialized"""
+	global _style_attrs
+	if _style_attrs is None:
+		_style_attrs = {
+			None: curses.A_NORMAL,
+			'bold': curses.A_BOLD,
+			'dim': curses.A_DIM,
+			'reverse': curses.A_REVERSE,
+			'underline': curses.A_UNDERLINE,
+			'green': curses.color_pair(GREEN),
+			'red': curses.color_pair(RED),
+			'yellow': curses.color_pair(YELLOW),
+		}
+	return _style_attrs
+
+@functools.lru_cache(maxsize = TOKEN_CACHE_SIZE)
+def tokenize(line):
+	"""Split a line into a tuple of (text, style) spans. Style is None for unformatted text."""
+	spans = []
+	idx = 0
+	for match in _TOKENIZER.finditer(line):
+		if match.start() > idx:
+			spans.append((str(line[idx:match.start()]), None))
+
+		style = match.lastgroup
+		spans.append((match.group(style), style))
+		idx = match.end()
+
+	if idx < len(line):
+		spans.append((str(line[idx:]), None))
+
+	return tuple(spans)
 
 def strip_wrappers(text):
 	"""Remove the formatting wrappers from any given text"""
-	patterns = get_formatting_patterns()
-	for pattern, value in patterns:
-		text = re.sub(pattern, r'\1', text)
-	return text	
-
-def render_text_line(window, y, x, line, default_attr = curses.A_NORMAL):
+	return ''.join(span for span, style in tokenize(text))
+
+_char_widths = {}
+
+def char_width(ch):
+	"""Number of terminal cells a single character takes up"""
+	width = _char_widths.get(ch)
+	if width is None:
+		if unicodedata.combining(ch) or unicodedata.category(ch) in ('Mn', 'Me', 'Cf'):
+			width = 0
+		elif unicodedata.east_asian_width(ch) in ('W', 'F'):
+			width = 2
+		else:
+			width = 1
+		_char_widths[ch] = width
+	return width
+
+@functools.lru_cache(maxsize = WIDTH_CACHE_SIZE)
+def _wide_display_width(text):
+	return sum(map(char_width, text))
+
+def display_width(text):
+	"""Number of terminal cells text takes up"""
+	if text.isascii():
+		return len(text)
+	return _wide_display_width(text)
+
+def clean_width(line):
+	"""Number of terminal cells a line takes up once the formatting wrappers are removed"""
+	return sum(display_width(span) for span, style in tokenize(line))
+
+def split_at_width(text, width):
+	"""Split text into a head that fits in width cells and the rest. The head has at least one character."""
+	if text.isascii():
+		width = max(1, width)
+		return text[:width], text[width:]
+
+	used = 0
+	for idx, ch in enumerate(text):
+		used += char_width(ch)
+		if used > width and idx:
+			return text[:idx], text[idx:]
+	return text, ''
+
+def truncate(text, width):
+	"""Cut plain text down to at most width cells, ending it with … when anything was cut"""
+	if display_width(text) <= width:
+		return text
+	if width <= 0:
+		return ''
+	head, rest = split_at_width(text, width - 1)
+	# split_at_width always keeps one character, even when it doesn't fit
+	if display_width(head) > width - 1:
+		head = ''
+	return head + '…'
+
+_WHITESPACE = re.compile(r'(\s+)')
+
+def _join_pieces(pieces):
+	"""Turn (text, style) pieces back into markup, opening and closing the tags around each run"""
+	res = []
 	idx = 0
-	while line:
-		# Find earliest match
-		earliest = None
-		earliest_match = None
-		earliest_attr = None
-
-		for pattern, attr in get_formatting_patterns():
-			match = re.search(pattern, line)
-			if match:
-				if earliest is None or match.start() < earliest:
-					earliest = match.start()
-					earliest_match = match
-					earliest_attr = attr
-
-		if earliest_match:
-			pre_text = line[:earliest_match.start()]
-			content = earliest_match.group(1)
-			line = line[earliest_match.end():]
-
-			if pre_text:
-				window.addstr(y, x + idx, pre_text, default_attr)
-				idx += len(pre_text)
-
-			window.addstr(y, x + idx, content, default_attr | earliest_attr)
-			idx += len(content)
+	while idx < len(pieces):
+		style = pieces[idx][1]
+		run = []
+		while idx < len(pieces) and pieces[idx][1] == style:
+			run.append(pieces[idx][0])
+			idx += 1
+
+		if style is None:
+			res.extend(run)
 		else:
-			window.addstr(y, x + idx, line, default_attr)
-			break
+			opening, closing = _TAGS[style]
+			res.append(opening + ''.join(run) + closing)
+	return ''.join(res)
+
+def wrap(line, width):
+	"""Word wrap a line into rows of at most width cells, like textwrap.wrap.
+
+	Widths are measured in terminal cells on the clean text, so formatting tags
+	don't count and wide characters count twice. Formatting that spans several
+	rows is reopened on each of them.
+	"""
+	if width <= 0:
+		raise ValueError(f"invalid width {width!r} (must be > 0)")
+
+	# Most lines fit on one row and only have plain spaces in them, so they come out as they are
+	spans = tokenize(line)
+	if spans and line.isprintable() and not spans[-1][0].endswith(' ') and clean_width(line) <= width:
+		return [line]
+
+	rows = []
+	row = []
+	row_width = 0
+
+	def end_row():
+		nonlocal row, row_width
+		# Trailing whitespace is dropped
+		while row and row[-1][0].isspace():
+			row.pop()
+		if row:
+			rows.append(_join_pieces(row))
+		row = []
+		row_width = 0
+
+	for span, style in spans:
+		for chunk in _WHITESPACE.split(span):
+			if not chunk:
+				continue
+
+			if chunk.isspace():
+				# Like textwrap, whitespace is only kept at the start of the first row
+				if not row and rows:
+					continue
+				chunk = ' ' * len(chunk)
+
+			chunk_width = display_width(chunk)
+			if row_width + chunk_width <= width:
+				row.append((chunk, style))
+				row_width += chunk_width
+				continue
+
+			if chunk.isspace():
+				end_row()
+				continue
+
+			if chunk_width <= width:
+				end_row()
+				row.append((chunk, style))
+				row_width = chunk_width
+				continue
+
+			# Too long for any row, so break it up. The first part fills whatever is left of this row.
+			while chunk:
+				if row_width >= width or (row and display_width(chunk[0]) > width - row_width):
+					end_row()
+				head, chunk = split_at_width(chunk, width - row_width)
+				row.append((head, style))
+				row_width += display_width(head)
+
+	end_row()
+	return rows
+
+def render_text_line(window, y, x, line, default_attr = curses.A_NORMAL, attrs = None):
+	if attrs is None:
+		attrs = get_style_attrs()
+	idx = 0
+	for span, style in tokenize(line):
+		window.addstr(y, x + idx, span, default_attr | attrs[style])
+		idx += display_width(span)
 
 class Text(str):
-	def __init__(self, raw):
-		self._str = raw
-		super = raw
+	"""A line of markup. The clean text and its display width are worked out once and kept."""
+	__slots__ = ('_clean', '_size')
+
+	def __new__(cls, raw = ''):
+		# Text is immutable, so there is no need to copy one
+		if type(raw) is cls:
+			return raw
+
+		self = super().__new__(cls, raw)
+		self._clean = None
+		self._size = None
+		return self
+
+	def _derive(self, res):
+		# Hand back self, with everything it has cached, when an operation didn't change anything
+		if res == self:
+			return self
+		return Text(res)
 
 	@property
 	def raw_size(self):
@@ -87,91 +267,93 @@ class Text(str):
 
 	@property
 	def size(self):
-		return len(self.clean)
+		if self._size is None:
+			self._size = clean_width(self)
+		return self._size
 
 	@property
 	def clean(self):
-		return Text(strip_wrappers(self))
+		if self._clean is None:
+			clean = strip_wrappers(self)
+			self._clean = self if clean == self else Text(clean)
+		return self._clean
 
 	def __add__(self, other):
-		return Text(self._str + other)
+		if other == '':
+			return self
+		return Text(str.__add__(self, other))
 
 	def __mul__(self, other):
-		return Text(self._str + other)
+		return self._derive(str.__mul__(self, other))
 
 	def __rmul__(self, other):
-		return Text(self._str + other)
+		return self._derive(str.__mul__(self, other))
 
 	def capitalize(self, *args, **kwargs):
-		return Text(self._str.capitalize(*args, **kwargs))
-
+		return self._derive(str.capitalize(self, *args, **kwargs))
 
 	def casefold(self, *args, **kwargs):
-		return Text(self._str.casefold(*args, **kwargs))
+		return self._derive(str.casefold(self, *args, **kwargs))
 
 	def center(self, *args, **kwargs):
-		return Text(self._str.center(*args, **kwargs))
-
-	def endswith(self, *args, **kwargs):
-		return Text(self._str.endswith(*args, **kwargs))
+		return self._derive(str.center(self, *args, **kwargs))
 
 	def expandtabs(self, *args, **kwargs):
-		return Text(self._str.expandtabs(*args, **kwargs))
+		return self._derive(str.expandtabs(self, *args, **kwargs))
 
 	def format(self, *args, **kwargs):
-		return Text(self._str.format(*args, **kwargs))
+		return self._derive(str.format(self, *args, **kwargs))
 
 	def format_map(self, *args, **kwargs):
-		return Text(self._str.format_map(*args, **kwargs))
+		return self._derive(str.format_map(self, *args, **kwargs))
 
 	def join(self, *args, **kwargs):
-		return Text(self._str.join(*args, **kwargs))
+		return self._derive(str.join(self, *args, **kwargs))
 
 	def ljust(self, *args, **kwargs):
-		return Text(self._str.ljust(*args, **kwargs))
+		return self._derive(str.ljust(self, *args, **kwargs))
 
 	def lower(self, *args, **kwargs):
-		return Text(self._str.lower(*args, **kwargs))
+		return self._derive(str.lower(self, *args, **kwargs))
 
 	def lstrip(self, *args, **kwargs):
-		return Text(self._str.lstrip(*args, **kwargs))
+		return self._derive(str.lstrip(self, *args, **kwargs))
 
 	def removeprefix(self, *args, **kwargs):
-		return Text(self._str.removeprefix(*args, **kwargs))
+		return self._derive(str.removeprefix(self, *args, **kwargs))
 
 	def removesuffix(self, *args, **kwargs):
-		return Text(self._str.removesuffix(*args, **kwargs))
+		return self._derive(str.removesuffix(self, *args, **kwargs))
 
 	def replace(self, *args, **kwargs):
-		return Text(self._str.replace(*args, **kwargs))
+		return self._derive(str.replace(self, *args, **kwargs))
 
 	def rjust(self, *args, **kwargs):
-		return Text(self._str.rjust(*args, **kwargs))
+		return self._derive(str.rjust(self, *args, **kwargs))
 
 	def rsplit(self, *args, **kwargs):
-		return [Text(s) for s in self._str.rsplit(*args, **kwargs)]
+		return [Text(s) for s in str.rsplit(self, *args, **kwargs)]
 
 	def rstrip(self, *args, **kwargs):
-		return Text(self._str.rstrip(*args, **kwargs))
+		return self._derive(str.rstrip(self, *args, **kwargs))
 
 	def split(self, *args, **kwargs):
-		return [Text(s) for s in self._str.split(*args, **kwargs)]
+		return [Text(s) for s in str.split(self, *args, **kwargs)]
 
 	def splitlines(self, *args, **kwargs):
-		return [Text(s) for s in self._str.splitlines(*args, **kwargs)]
+		return [Text(s) for s in str.splitlines(self, *args, **kwargs)]
 
 	def strip(self, *args, **kwargs):
-		return Text(self._str.strip(*args, **kwargs))
+		return self._derive(str.strip(self, *args, **kwargs))
 
 	def title(self, *args, **kwargs):
-		return Text(self._str.title(*args, **kwargs))
+		return self._derive(str.title(self, *args, **kwargs))
 
 	def translate(self, *args, **kwargs):
-		return Text(self._str.translate(*args, **kwargs))
+		return self._derive(str.translate(self, *args, **kwargs))
 
 	def upper(self, *args, **kwargs):
-		return Text(self._str.upper(*args, **kwargs))
+		return self._derive(str.upper(self, *args, **kwargs))
 
 	def zfill(self, *args, **kwargs):
-		return Text(self._str.zfill(*args, **kwargs))
-
+		return self._derive(str.zfill(self, *args, **kwargs))
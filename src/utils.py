@@ -1,6 +1,7 @@
+import re
 import time
 from text import Text
-from datetime import datetime
+from datetime import datetime, timedelta
 
 def get_clock_time(timestamp):
 	return Text(datetime.fromtimestamp(timestamp).strftime("%H:%M:%S"))
@@ -14,3 +15,40 @@ def lr_justified(left : Text, right : Text, n):
 
 	middle_space = n - left.size - right.size
 	return Text(left+ (' ' * middle_space) + right)
+
+# The - is optional, since :jump can't be given an argument that starts with one
+_RELATIVE = re.compile(r'-?((\d+)([dhms]))+( ago)?')
+_UNITS = {'d': 86400, 'h': 3600, 'm': 60, 's': 1}
+_TIME_FORMATS = ("%H:%M", "%H:%M:%S")
+_DATE_FORMATS = ("%d/%m/%y", "%Y-%m-%d", "%d/%m/%y %H:%M", "%Y-%m-%d %H:%M")
+
+def parse_time(spec, now = None):
+	"""Timestamp for a point in time given as 2h / 1h30m / 2h ago / -2h (relative), 14:30 (the last
+	time it was 14:30), 31/01/24 or 2024-01-31, optionally followed by a time.
+	Raises ValueError if spec is none of these."""
+	if now is None:
+		now = time.time()
+
+	spec = spec.strip()
+	if _RELATIVE.fullmatch(spec):
+		return now - sum(int(n) * _UNITS[unit] for n, unit in re.findall(r'(\d+)([dhms])', spec))
+
+	current = datetime.fromtimestamp(now)
+	for fmt in _TIME_FORMATS:
+		try:
+			clock = datetime.strptime(spec, fmt).time()
+		except ValueError:
+			continue
+		res = datetime.combine(current.date(), clock)
+		# A time later than now means yesterday
+		if res > current:
+			res -= timedelta(days = 1)
+		return res.timestamp()
+
+	for fmt in _DATE_FORMATS:
+		try:
+			return datetime.strptime(spec, fmt).timestamp()
+		except ValueError:
+			continue
+
+	raise ValueError(f"Can't read {spec!r} as a time")